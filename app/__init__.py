@@ -14,14 +14,14 @@ csrf = CSRFProtect(app)
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-from app import views, models
-from app.models import User
+# sqlite pragmas etc from config.py
+from app.database import configure_engine
+with app.app_context():
+    configure_engine(db.engine, app.config)
 
-# Initialize login management
+# Initialize login management (the user loader is in app/auth.py)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
\ No newline at end of file
+from app import views, models, commands, metrics, auth, api, stats, analytics, notifications, jobs, mail, passwords, photos, compression
@@ -0,0 +1,194 @@
+from datetime import datetime
+from flask import current_app
+from app import db, cache, stats
+from app.models import Item, Loan, LoanRollup, User
+
+# the owner dashboard: loans per month, most borrowed items, average loan length,
+# repair backlog and top borrowers for one inventory
+#
+# it is all worked out by the database with GROUP BY and window queries. finished
+# months come from the loan_rollups table (filled in nightly by "flask
+# rollup-loans") and only the loans since the last rolled up month are read from
+# the loans table, so the page costs about the same however many years of loans
+# there are. without any rollups every loan is read. the results are cached per
+# inventory (see dashboard()).
+
+# rows in the most borrowed items and top borrowers lists
+TOP = 10
+
+ACTIVITY_COLUMNS = ('month', 'item_id', 'borrower_id', 'requests', 'loans', 'returns', 'loan_days')
+
+
+def _sqlite():
+    return db.session.get_bind().dialect.name == 'sqlite'
+
+
+# "YYYY-MM" for a datetime column
+def _month(column):
+    if _sqlite():
+        return db.func.strftime('%Y-%m', column)
+    return db.func.to_char(column, 'YYYY-MM')
+
+
+# days between two datetime columns (with fractions)
+def _days(start, end):
+    if _sqlite():
+        return db.func.julianday(end) - db.func.julianday(start)
+    return db.func.extract('epoch', end - start) / 86400.0
+
+
+def _month_start(month):
+    return datetime.strptime(month, '%Y-%m')
+
+
+def _next_month(start):
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+# the last month in loan_rollups, later loans are read from the loans table
+def rolled_up_through():
+    return db.session.scalar(db.select(db.func.max(LoanRollup.month)))
+
+
+# one row per loan event (a request, an approval or a return) that happened in
+# [since, until), counted in the month it happened, with the columns in ACTIVITY_COLUMNS
+# plus inventory_id
+def _activity(inventory_id=None, since=None, until=None):
+    def events(date_column, requests, loans, returns, loan_days, *conditions):
+        query = (
+            db.select(
+                Item.inventory_id.label('inventory_id'),
+                _month(date_column).label('month'),
+                Loan.item_id.label('item_id'),
+                Loan.borrower_id.label('borrower_id'),
+                db.literal(requests).label('requests'),
+                db.literal(loans).label('loans'),
+                db.literal(returns).label('returns'),
+                db.cast(loan_days, db.Float).label('loan_days'),
+            )
+            .join(Loan.item)
+            .where(date_column.isnot(None), *conditions)
+        )
+        if inventory_id is not None:
+            query = query.where(Item.inventory_id == inventory_id)
+        if since is not None:
+            query = query.where(date_column >= since)
+        if until is not None:
+            query = query.where(date_column < until)
+        return query
+
+    return db.union_all(
+        events(Loan.request_date, 1, 0, 0, db.literal(0.0)),
+        events(Loan.approved_date, 0, 1, 0, db.literal(0.0)),
+        # only returns with an approval date can be timed
+        events(Loan.returned_date, 0, 0, 1, _days(Loan.approved_date, Loan.returned_date),
+               Loan.approved_date.isnot(None)),
+    )
+
+
+# add the months that have finished since the last run to loan_rollups (commits)
+# returns the number of rows added. run it nightly (or at least monthly), running
+# it more often than that does nothing
+def rollup(now=None):
+    last = rolled_up_through()
+    since = _next_month(_month_start(last)) if last else None
+    until = (now or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if since is not None and since >= until:
+        return 0
+
+    activity = _activity(since=since, until=until).subquery()
+    keys = [activity.c.inventory_id, activity.c.month, activity.c.item_id, activity.c.borrower_id]
+    totals = db.select(
+        *keys,
+        db.func.sum(activity.c.requests),
+        db.func.sum(activity.c.loans),
+        db.func.sum(activity.c.returns),
+        db.func.sum(activity.c.loan_days),
+    ).group_by(*keys)
+    added = db.session.execute(
+        db.insert(LoanRollup).from_select(
+            ['inventory_id', 'month', 'item_id', 'borrower_id', 'requests', 'loans', 'returns', 'loan_days'], totals
+        )
+    ).rowcount
+    db.session.commit()
+    return added
+
+
+# the rolled up months and the loans since, for one inventory
+def _inventory_activity(inventory_id):
+    last = rolled_up_through()
+    rolled_up = db.select(*[getattr(LoanRollup, name) for name in ACTIVITY_COLUMNS]).where(
+        LoanRollup.inventory_id == inventory_id
+    )
+    recent = _activity(inventory_id, since=_next_month(_month_start(last)) if last else None).subquery()
+    return db.union_all(rolled_up, db.select(*[recent.c[name] for name in ACTIVITY_COLUMNS])).subquery()
+
+
+def compute(inventory_id):
+    activity = _inventory_activity(inventory_id)
+    loans = db.func.sum(activity.c.loans)
+
+    per_month = db.session.execute(
+        db.select(activity.c.month, db.func.sum(activity.c.requests), loans, db.func.sum(activity.c.returns))
+        .group_by(activity.c.month)
+        .order_by(activity.c.month)
+    ).all()
+
+    returns, loan_days = db.session.execute(
+        db.select(db.func.sum(activity.c.returns), db.func.sum(activity.c.loan_days))
+    ).one()
+
+    # items that have since been deleted have no name
+    item_loans = (
+        db.select(activity.c.item_id, loans.label('loans'))
+        .group_by(activity.c.item_id)
+        .having(loans > 0)
+        .order_by(loans.desc(), activity.c.item_id)
+        .limit(TOP)
+        .subquery()
+    )
+    most_borrowed = db.session.execute(
+        db.select(item_loans.c.item_id, Item.name, item_loans.c.loans)
+        .outerjoin(Item, Item.id == item_loans.c.item_id)
+        .order_by(item_loans.c.loans.desc(), item_loans.c.item_id)
+    ).all()
+
+    # ties share a rank
+    borrower_loans = (
+        db.select(
+            activity.c.borrower_id,
+            loans.label('loans'),
+            db.func.rank().over(order_by=loans.desc()).label('rank'),
+        )
+        .group_by(activity.c.borrower_id)
+        .having(loans > 0)
+        .order_by(loans.desc(), activity.c.borrower_id)
+        .limit(TOP)
+        .subquery()
+    )
+    top_borrowers = db.session.execute(
+        db.select(borrower_loans.c.rank, User.username, borrower_loans.c.loans)
+        .outerjoin(User, User.id == borrower_loans.c.borrower_id)
+        .order_by(borrower_loans.c.rank, borrower_loans.c.borrower_id)
+    ).all()
+
+    # the repair backlog is read straight from the inventory counters
+    counters = stats.get(inventory_id)
+
+    return {
+        'per_month': [{'month': month, 'requests': requests or 0, 'loans': approved or 0, 'returns': returned or 0}
+                      for month, requests, approved, returned in per_month],
+        'returns': returns or 0,
+        'average_loan_days': loan_days / returns if returns else None,
+        'most_borrowed': [{'item_id': item_id, 'name': name, 'loans': count} for item_id, name, count in most_borrowed],
+        'top_borrowers': [{'rank': rank, 'username': username, 'loans': count} for rank, username, count in top_borrowers],
+        'repair_backlog': {condition: counters[condition] for condition in stats.CONDITIONS if condition != 'functional'},
+        'counters': counters,
+    }
+
+
+# the dashboard for an inventory, cached until its items change or for
+# DASHBOARD_CACHE_TTL seconds (new requests don't invalidate it)
+def dashboard(inventory_id):
+    return cache.cached(cache.inventory_namespace(inventory_id), 'dashboard', lambda: compute(inventory_id),
+                        ttl=current_app.config['DASHBOARD_CACHE_TTL'])
@@ -0,0 +1,329 @@
+from datetime import datetime
+from flask import Blueprint, jsonify, request, g, abort, current_app
+from sqlalchemy import insert
+from werkzeug.exceptions import HTTPException
+from app import app, db, csrf, cache, search, importer, loans, stats, notifications
+from app.database import run_transaction
+from app.auth import load_api_user
+from app.models import Inventory, Item, Loan, Notification
+from app.pagination import keyset_paginate
+
+# json api for scripts and kiosk scanners, everything is under /api/v1
+#
+# requests authenticate with "Authorization: Bearer <token>" (make a token with
+# "flask create-api-token <email>"), session cookies are ignored so the api
+# doesn't need csrf tokens.
+#
+# list endpoints use the same keyset pagination as the pages: pass the
+# next_after value back as ?after= (or prev_before as ?before=) with ?per_page=.
+# the batch endpoints apply every change in one transaction, if any entry is
+# invalid nothing is changed and the problems are returned with status 422.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+csrf.exempt(api)
+
+INVENTORY_COLUMNS = (Inventory.id, Inventory.owner_id, Inventory.title, Inventory.description)
+ITEM_COLUMNS = (Item.id, Item.inventory_id, Item.name, Item.description, Item.condition, Item.loan_status, Item.photo)
+LOAN_COLUMNS = (Loan.id, Loan.item_id, Loan.borrower_id, Loan.owner_id, Loan.status, Loan.request_date,
+                Loan.approved_date, Loan.returned_date)
+NOTIFICATION_COLUMNS = (Notification.id, Notification.message, Notification.link, Notification.is_read, Notification.created_at)
+
+
+def error(status, message, **extra):
+    response = jsonify(error=message, **extra)
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(HTTPException)
+def http_error(e):
+    return error(e.code, e.description)
+
+
+@api.before_request
+def authenticate():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    user = load_api_user(token.strip()) if scheme.lower() == 'bearer' and token.strip() else None
+    if user is None:
+        return error(401, 'A valid "Authorization: Bearer <token>" header is required.')
+    g.api_user = user
+
+
+def row_json(row):
+    data = row._asdict()
+    for name, value in data.items():
+        if isinstance(value, datetime):
+            data[name] = value.isoformat()
+    return data
+
+
+def page_json(query, column):
+    page = keyset_paginate(query, column)
+    return jsonify(data=[row_json(row) for row in page], next_after=page.next_cursor, prev_before=page.prev_cursor)
+
+
+def one_json(query):
+    row = query.first()
+    if row is None:
+        abort(404, 'Not found.')
+    return jsonify(data=row_json(row))
+
+
+# ?name=value filters that are applied when given
+def filter_by_args(query, filters):
+    for arg, column in filters:
+        value = request.args.get(arg)
+        if value is not None:
+            query = query.filter(column == value)
+    return query
+
+
+# the list under key in the request body, checked to be all ids
+def id_list(body, key):
+    ids = body.get(key, [])
+    if not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+        abort(400, '"%s" must be a list of ids.' % key)
+    return ids
+
+
+def json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, 'Expected a JSON object.')
+    return body
+
+
+def check_batch_size(*lists):
+    if sum(len(entries) for entries in lists) > current_app.config['API_MAX_BATCH']:
+        abort(400, 'At most %d changes can be made in one request.' % current_app.config['API_MAX_BATCH'])
+
+
+# ?owner_id= ?mine=1 ?q= (searches titles)
+@api.route('/inventories')
+def list_inventories():
+    query = filter_by_args(db.session.query(*INVENTORY_COLUMNS), [('owner_id', Inventory.owner_id)])
+    if request.args.get('mine'):
+        query = query.filter(Inventory.owner_id == g.api_user.id)
+    if request.args.get('q'):
+        query = query.filter(Inventory.title.contains(request.args['q'], autoescape=True))
+    return page_json(query, Inventory.id)
+
+
+@api.route('/inventories/<int:inventory_id>')
+def get_inventory(inventory_id):
+    return one_json(db.session.query(*INVENTORY_COLUMNS).filter(Inventory.id == inventory_id))
+
+
+# item counts by loan status and condition, total items and pending loan requests
+@api.route('/inventories/<int:inventory_id>/stats')
+def get_inventory_stats(inventory_id):
+    if db.session.get(Inventory, inventory_id) is None:
+        abort(404, 'Not found.')
+    return jsonify(data=stats.get(inventory_id))
+
+
+# ?condition= ?loan_status= ?q= (searches names)
+@api.route('/inventories/<int:inventory_id>/items')
+def list_items(inventory_id):
+    if db.session.get(Inventory, inventory_id) is None:
+        abort(404, 'Not found.')
+    query = db.session.query(*ITEM_COLUMNS).filter(Item.inventory_id == inventory_id)
+    query = filter_by_args(query, [('condition', Item.condition), ('loan_status', Item.loan_status)])
+    if request.args.get('q'):
+        query = query.filter(Item.name.contains(request.args['q'], autoescape=True))
+    return page_json(query, Item.id)
+
+
+@api.route('/items/<int:item_id>')
+def get_item(item_id):
+    return one_json(db.session.query(*ITEM_COLUMNS).filter(Item.id == item_id))
+
+
+# create, update and delete items in the users inventories in one transaction
+# {"create": [{"name": .., "description": .., "loan_status": .., "condition": .., "inventory_id": ..}],
+#  "update": [{"id": .., any of the fields}],
+#  "delete": [id, ...]}
+# inventory_id can be left out if the user only has one inventory
+@api.route('/items/batch', methods=['POST'])
+def batch_items():
+    body = json_body()
+    creates = body.get('create', [])
+    updates = body.get('update', [])
+    if not isinstance(creates, list) or not isinstance(updates, list):
+        abort(400, '"create" and "update" must be lists of objects.')
+    delete_ids = id_list(body, 'delete')
+    check_batch_size(creates, updates, delete_ids)
+
+    owned = db.session.scalars(
+        db.select(Inventory.id).where(Inventory.owner_id == g.api_user.id).order_by(Inventory.id)
+    ).all()
+    default_inventory = owned[0] if owned else None
+    errors = []
+
+    new_rows = []
+    for index, row in enumerate(creates):
+        values, problems = importer.validate_item_row(row)
+        inventory_id = row.get('inventory_id', default_inventory) if isinstance(row, dict) else None
+        if inventory_id not in owned:
+            problems = problems + ['inventory_id: Not one of your inventories.']
+        if problems:
+            errors.append({'create': index, 'errors': problems})
+        else:
+            values['inventory_id'] = inventory_id
+            new_rows.append(values)
+
+    changed_rows = []
+    seen = set()
+    for index, row in enumerate(updates):
+        if not isinstance(row, dict) or not isinstance(row.get('id'), int):
+            errors.append({'update': index, 'errors': ['id: This field is required.']})
+            continue
+        if row['id'] in seen:
+            errors.append({'update': index, 'errors': ['id: Item is listed more than once.']})
+            continue
+        seen.add(row['id'])
+        values, problems = importer.validate_item_row({k: v for k, v in row.items() if k != 'id'}, partial=True)
+        if not problems and not values:
+            problems = ['No fields to update.']
+        if problems:
+            errors.append({'update': index, 'errors': problems})
+        else:
+            values['id'] = row['id']
+            changed_rows.append((index, values))
+
+    deletes = set(delete_ids)
+    # an item updated and deleted in the same request is just deleted
+    changed_rows = [(index, values) for index, values in changed_rows if values['id'] not in deletes]
+    item_ids = {values['id'] for _, values in changed_rows} | deletes
+    if errors:
+        return error(422, 'Nothing was changed, fix the errors and try again.', errors=errors)
+
+    def work():
+        # the users items being changed as they are now. the updates only apply if
+        # the items still have the version read here, otherwise the orm raises
+        # StaleDataError and run_transaction starts again
+        current = {row.id: row for row in db.session.execute(
+            db.select(Item.id, Item.inventory_id, Item.loan_status, Item.condition, Item.version)
+            .where(Item.id.in_(item_ids), Item.inventory_id.in_(owned))
+        )} if item_ids and owned else {}
+        missing = [{'update': index, 'errors': ['id: Item not found.']}
+                   for index, values in changed_rows if values['id'] not in current]
+        missing += [{'delete': index, 'errors': ['id: Item not found.']}
+                    for index, item_id in enumerate(delete_ids) if item_id not in current]
+        if missing:
+            return None, current, missing
+
+        deltas = stats.Deltas()
+        created = []
+        if new_rows:
+            created = db.session.execute(
+                insert(Item).returning(Item.id, sort_by_parameter_order=True), new_rows
+            ).scalars().all()
+            for row in new_rows:
+                deltas.item(row['inventory_id'], row['loan_status'], row['condition'])
+        if changed_rows:
+            # bulk UPDATE by primary key (one executemany per distinct set of fields)
+            db.session.execute(db.update(Item), [dict(values, version=current[values['id']].version)
+                                                 for _, values in changed_rows])
+            for _, values in changed_rows:
+                old = current[values['id']]
+                deltas.item(old.inventory_id, old.loan_status, old.condition, -1)
+                deltas.item(old.inventory_id, values.get('loan_status', old.loan_status), values.get('condition', old.condition))
+        if deletes:
+            pending = db.session.execute(
+                db.delete(Loan).where(Loan.item_id.in_(deletes)).returning(Loan.item_id, Loan.status)
+            ).all()
+            db.session.execute(db.delete(Item).where(Item.id.in_(deletes)))
+            for item_id in deletes:
+                old = current[item_id]
+                deltas.item(old.inventory_id, old.loan_status, old.condition, -1)
+            for item_id, status in pending:
+                if status == 'pending':
+                    deltas.pending_loans(current[item_id].inventory_id, -1)
+        deltas.apply()
+        search.queue_items(created + [values['id'] for _, values in changed_rows] + list(deletes))
+        return created, current, []
+
+    created, current, missing = run_transaction(db.session, work)
+    if missing:
+        return error(422, 'Nothing was changed, fix the errors and try again.', errors=missing)
+
+    inventory_ids = {row['inventory_id'] for row in new_rows} | {row.inventory_id for row in current.values()}
+    cache.invalidate(*[cache.inventory_namespace(inventory_id) for inventory_id in inventory_ids])
+
+    updated = sorted(values['id'] for _, values in changed_rows)
+    return jsonify(created=created, updated=updated, deleted=sorted(deletes))
+
+
+# ?role=owner|borrower (default both) ?status= ?item_id=
+@api.route('/loans')
+def list_loans():
+    user_id = g.api_user.id
+    role = request.args.get('role')
+    query = db.session.query(*LOAN_COLUMNS)
+    if role == 'owner':
+        query = query.filter(Loan.owner_id == user_id)
+    elif role == 'borrower':
+        query = query.filter(Loan.borrower_id == user_id)
+    elif role is None:
+        query = query.filter((Loan.owner_id == user_id) | (Loan.borrower_id == user_id))
+    else:
+        abort(400, 'role must be owner or borrower.')
+    query = filter_by_args(query, [('status', Loan.status), ('item_id', Loan.item_id)])
+    return page_json(query, Loan.id)
+
+
+@api.route('/loans/<int:loan_id>')
+def get_loan(loan_id):
+    user_id = g.api_user.id
+    return one_json(
+        db.session.query(*LOAN_COLUMNS)
+        .filter(Loan.id == loan_id, (Loan.owner_id == user_id) | (Loan.borrower_id == user_id))
+    )
+
+
+# approve and reject requests for the users items in one transaction
+# {"approve": [loan id, ...], "reject": [loan id, ...]}
+# other pending requests for the items that get lent out are rejected too
+# (returned as auto_rejected), loans that aren't pending requests for the users
+# items (or whose item is already lent out) are returned as skipped
+@api.route('/loans/batch', methods=['POST'])
+def batch_loans():
+    body = json_body()
+    approve = id_list(body, 'approve')
+    reject = id_list(body, 'reject')
+    check_batch_size(approve, reject)
+    if set(approve) & set(reject):
+        abort(422, 'A loan can\'t be approved and rejected at once.')
+
+    decisions = loans.decide(g.api_user.id, approve, reject)
+
+    return jsonify(approved=decisions.approved, rejected=decisions.rejected,
+                   auto_rejected=decisions.auto_rejected, skipped=decisions.skipped)
+
+
+# the users notifications, newest first ?unread=1 for only the unread ones
+# (the unread count is returned too)
+@api.route('/notifications')
+def list_notifications():
+    query = db.session.query(*NOTIFICATION_COLUMNS).filter(Notification.user_id == g.api_user.id)
+    if request.args.get('unread'):
+        query = query.filter(Notification.is_read == db.false())
+    page = keyset_paginate(query, Notification.id, descending=True)
+    return jsonify(data=[row_json(row) for row in page], next_after=page.next_cursor, prev_before=page.prev_cursor,
+                   unread=notifications.unread_count(g.api_user.id))
+
+
+# {"ids": [notification id, ...]} or {"all": true}
+@api.route('/notifications/mark-read', methods=['POST'])
+def mark_notifications_read():
+    body = json_body()
+    if body.get('all') is True:
+        marked = notifications.mark_read(g.api_user.id)
+    else:
+        ids = id_list(body, 'ids')
+        check_batch_size(ids)
+        marked = notifications.mark_read(g.api_user.id, ids)
+    return jsonify(marked=marked, unread=notifications.unread_count(g.api_user.id))
+
+app.register_blueprint(api)
@@ -0,0 +1,67 @@
+import hashlib
+import secrets
+from flask_login import UserMixin
+from sqlalchemy import event
+from app import app, db, login_manager
+from app.cache import MemoryCache, MISS
+from app.models import User, ApiToken
+
+# flask-login calls load_user on every request from a logged in user to rebuild
+# current_user. the few fields the pages need are kept in a per process cache so
+# that doesn't cost a database round trip every time.
+# entries are dropped when the user row is changed or deleted in this process,
+# other workers pick up the change once USER_CACHE_TTL runs out
+
+
+class CachedUser(UserMixin):
+    # stands in for User as current_user (it isn't attached to a session,
+    # load the real User if you need to change it)
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+
+user_cache = MemoryCache(app.config['USER_CACHE_MAX_ENTRIES'], app.config['USER_CACHE_TTL'])
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    fields = user_cache.get(user_id)
+    if fields is MISS:
+        row = db.session.query(User.id, User.username, User.email).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        fields = tuple(row)
+        user_cache.set(user_id, fields)
+    return CachedUser(*fields)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_user(mapper, connection, target):
+    user_cache.delete(target.id)
+
+
+# api tokens are random strings handed out once, only their sha256 is stored so
+# a leaked database doesn't leak working tokens (they are long enough that a
+# fast hash is fine, unlike passwords)
+def hash_api_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# make a new token for the user, returns the token itself (it can't be shown again)
+def create_api_token(user_id, name):
+    token = secrets.token_urlsafe(32)
+    db.session.add(ApiToken(user_id=user_id, name=name, token_hash=hash_api_token(token)))
+    db.session.commit()
+    return token
+
+
+# the user the token belongs to, or None if it isn't a valid token
+def load_api_user(token):
+    user_id = db.session.query(ApiToken.user_id).filter(ApiToken.token_hash == hash_api_token(token)).scalar()
+    if user_id is None:
+        return None
+    return load_user(user_id)
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app
+
+# small pluggable cache for data that is read far more often than it changes
+#
+# CACHE_BACKEND picks where entries live:
+#   "memory" - an LRU dict in this process (the default)
+#   "file"   - pickled files in CACHE_DIR shared by every worker on the machine
+#              (point CACHE_DIR at /dev/shm to keep them in shared memory)
+#   "none"   - nothing is cached
+#
+# entries are grouped into namespaces (e.g. "inventory:3"). each namespace has a
+# version token that is part of every key in it, invalidating a namespace just
+# gives it a new token so all its old entries stop being found and age out.
+# the tokens are always kept in files under CACHE_DIR (even for the memory
+# backend) so every process on the machine sees an invalidation at once. processes
+# on different machines need CACHE_DIR on storage they all share.
+
+MISS = object()
+
+
+class MemoryCache:
+    # max_bytes (optional) also caps the total size of the values, as measured
+    # by sys.getsizeof, which is only the whole size for strings and bytes
+    def __init__(self, max_entries=1024, default_ttl=300, max_bytes=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires, value, _ = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                return MISS
+            # most recently used entries live at the end
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=MISS):
+        ttl = self.default_ttl if ttl is MISS else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        size = sys.getsizeof(value) if self.max_bytes else 0
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires, value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.size > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache:
+    def __init__(self, directory, max_entries=4096, default_ttl=300):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.cache')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISS
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return MISS
+        return value
+
+    def set(self, key, value, ttl=MISS):
+        ttl = self.default_ttl if ttl is MISS else ttl
+        expires = time.time() + ttl if ttl else None
+        # write to a temporary file and rename it so other workers never read half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _prune(self):
+        # drop the least recently written files once there are too many
+        names = [name for name in os.listdir(self.directory) if name.endswith('.cache')]
+        if len(names) <= self.max_entries:
+            return
+        paths = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        paths.sort()
+        for _, path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class NullCache:
+    def get(self, key):
+        return MISS
+
+    def set(self, key, value, ttl=MISS):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+_cache = None
+_versions = None
+_cache_lock = threading.Lock()
+
+
+def _setup():
+    global _cache, _versions
+    with _cache_lock:
+        if _cache is not None:
+            return
+        config = current_app.config
+        backend = config['CACHE_BACKEND']
+        if backend == 'memory':
+            cache = MemoryCache(config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+            # the entries stay in this process but the version tokens are files
+            # every process on the machine reads, so a write made by another
+            # worker, `flask import-items` or `flask run-jobs` still invalidates
+            # what this one has cached
+            versions = FileCache(os.path.join(config['CACHE_DIR'], 'versions'), config['CACHE_MAX_ENTRIES'], None)
+        elif backend == 'file':
+            cache = versions = FileCache(config['CACHE_DIR'], config['CACHE_MAX_ENTRIES'], config['CACHE_DEFAULT_TTL'])
+        elif backend == 'none':
+            cache = versions = NullCache()
+        else:
+            raise ValueError('unknown CACHE_BACKEND %r' % backend)
+        _versions = versions
+        _cache = cache
+
+
+def get_cache():
+    if _cache is None:
+        _setup()
+    return _cache
+
+
+# where the namespace version tokens are kept
+def get_versions():
+    if _versions is None:
+        _setup()
+    return _versions
+
+
+def _version(namespace):
+    versions = get_versions()
+    token = versions.get('version:' + namespace)
+    if token is MISS:
+        # never expires on its own, a new token only comes from invalidate()
+        token = uuid.uuid4().hex
+        versions.set('version:' + namespace, token, ttl=None)
+    return token
+
+
+# return the cached value for key in namespace, working it out with compute() if needed
+def cached(namespace, key, compute, ttl=MISS):
+    cache = get_cache()
+    full_key = '%s:%s:%s' % (namespace, _version(namespace), key)
+    value = cache.get(full_key)
+    if value is MISS:
+        value = compute()
+        cache.set(full_key, value, ttl)
+    return value
+
+
+# forget everything cached in the given namespaces
+# (a random token rather than a counter so two workers invalidating at once can't
+# both end up writing the same new version)
+def invalidate(*namespaces):
+    versions = get_versions()
+    for namespace in namespaces:
+        versions.set('version:' + namespace, uuid.uuid4().hex, ttl=None)
+
+
+# namespaces used by the views
+# the list of all inventories
+INVENTORIES = 'inventories'
+
+
+# the items in one inventory
+def inventory_namespace(inventory_id):
+    return 'inventory:%d' % inventory_id
@@ -0,0 +1,126 @@
+import time
+import click
+from app import app, db
+from app import search, importer, auth, stats, analytics, jobs, photos
+from app.models import Inventory, User, ApiToken
+
+# extra flask commands, run with "flask <command>"
+
+
+@app.cli.command('search-reindex')
+def search_reindex():
+    """Rebuild the item search index from the database."""
+    counts = search.rebuild_index()
+    click.echo('Indexed %(items)d items and %(inventories)d inventories.' % counts)
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--inventory', 'inventory_ids', type=int, multiple=True, help='Only check these inventories.')
+def reconcile_counters(inventory_ids):
+    """Recompute the per inventory item and loan counters from scratch."""
+    wrong = stats.reconcile(list(inventory_ids) or None)
+    if wrong:
+        click.echo('Fixed the counters of %d inventories: %s' % (len(wrong), ', '.join(map(str, wrong))))
+    else:
+        click.echo('All counters were correct.')
+
+
+@app.cli.command('rollup-loans')
+def rollup_loans():
+    """Add the loan activity of finished months to the dashboard rollups (run nightly)."""
+    added = analytics.rollup()
+    click.echo('Added %d rollup rows, loans are rolled up through %s.' % (added, analytics.rolled_up_through() or 'nothing yet'))
+
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=None, type=int, help='Worker threads (default JOBS_WORKERS).')
+@click.option('--burst', is_flag=True, help='Run the jobs that are due now and exit.')
+def run_jobs(workers, burst):
+    """Run background jobs (emails, search index updates) until stopped."""
+    if burst:
+        click.echo('Ran %d jobs.' % jobs.run_pending())
+        return
+    pool = jobs.start_workers(workers or app.config['JOBS_WORKERS'] or 1)
+    click.echo('Running jobs with %d workers, press Ctrl+C to stop.' % len(pool.threads))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+@app.cli.command('retry-failed-jobs')
+def retry_failed_jobs():
+    """Queue the jobs that failed every attempt again."""
+    click.echo('Queued %d failed jobs again.' % jobs.retry_failed())
+
+
+@app.cli.command('prune-photos')
+@click.option('--min-age', default=3600, show_default=True, help='Keep files newer than this many seconds.')
+def prune_photos(min_age):
+    """Delete the stored photos and thumbnails that no item uses."""
+    click.echo('Deleted %d unused photo files.' % photos.prune(min_age))
+
+
+@app.cli.command('smtp-sink')
+@click.option('--host', default='localhost', show_default=True)
+@click.option('--port', default=8025, show_default=True)
+@click.option('--directory', default='mail-sink', show_default=True, help='Where the messages are saved.')
+def smtp_sink(host, port, directory):
+    """Run a local SMTP server that saves emails to files instead of sending them."""
+    from app.smtp_sink import SinkServer
+
+    server = SinkServer((host, port), directory, echo=click.echo)
+    click.echo('Saving mail sent to %s:%d in %s/, press Ctrl+C to stop.' % (host, port, directory))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+@app.cli.command('import-items')
+@click.argument('inventory_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=importer.BATCH_SIZE, show_default=True, help='Rows per INSERT/transaction.')
+def import_items(inventory_id, path, batch_size):
+    """Import items into an inventory from a CSV or JSON file."""
+    if db.session.get(Inventory, inventory_id) is None:
+        raise click.ClickException('Inventory %d not found.' % inventory_id)
+
+    with open(path, 'rb') as f:
+        try:
+            rows = importer.iter_rows(f, path)
+        except importer.ImportFormatError as e:
+            raise click.ClickException(str(e))
+        result = importer.import_items(inventory_id, rows, batch_size=batch_size, index_in_background=False)
+
+    for row_number, messages in result.errors:
+        click.echo('row %d: %s' % (row_number, '; '.join(messages)), err=True)
+    if result.error_count > len(result.errors):
+        click.echo('... and %d more rows with errors' % (result.error_count - len(result.errors)), err=True)
+    if result.format_error:
+        click.echo('stopped reading the file: %s' % result.format_error, err=True)
+    click.echo('Imported %d items, %d rows had errors.' % (result.imported, result.error_count))
+
+
+@app.cli.command('create-api-token')
+@click.argument('email')
+@click.option('--name', default='api', show_default=True, help='What the token is for.')
+def create_api_token(email, name):
+    """Make a token for the JSON API and print it."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException('No user with email %s.' % email)
+    click.echo(auth.create_api_token(user.id, name))
+
+
+@app.cli.command('revoke-api-tokens')
+@click.argument('email')
+def revoke_api_tokens(email):
+    """Delete every JSON API token a user has."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException('No user with email %s.' % email)
+    count = ApiToken.query.filter_by(user_id=user.id).delete()
+    db.session.commit()
+    click.echo('Revoked %d tokens.' % count)
@@ -0,0 +1,100 @@
+import gzip
+import zlib
+from flask import request
+from app import app
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, without it responses are only gzipped
+    brotli = None
+
+# compresses responses for clients that accept it (Accept-Encoding)
+#
+# brotli is preferred when it is installed and the client accepts it, gzip
+# otherwise. only text types (COMPRESS_MIMETYPES) are compressed, images and
+# xlsx files are already compressed. pages smaller than COMPRESS_MIN_SIZE are
+# sent as they are, the headers would cost more than compressing saves.
+#
+# streamed responses (the csv exports) are compressed chunk by chunk as they
+# are sent, so they still never sit in memory as a whole.
+#
+# a compressed response's ETag is made weak, the bytes differ from the plain
+# page but it is still the same page (If-None-Match compares weakly anyway).
+
+
+def choose_encoding(accept_encodings):
+    # the best encoding the client will take, or None to send it as it is
+    gzip_quality = accept_encodings.quality('gzip')
+    if brotli is not None and accept_encodings.quality('br') and accept_encodings.quality('br') >= gzip_quality:
+        return 'br'
+    if gzip_quality:
+        return 'gzip'
+    return None
+
+
+def compress(encoding, data):
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL'], mtime=0)
+
+
+# compress an iterable of chunks, yielding compressed data as it becomes available
+def compress_stream(encoding, chunks):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress_chunk, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compress_chunk(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _compressible(response):
+    return (
+        response.mimetype in app.config['COMPRESS_MIMETYPES']
+        and 'Content-Encoding' not in response.headers
+        and not response.cache_control.no_transform
+    )
+
+
+@app.after_request
+def compress_response(response):
+    if not app.config['COMPRESS_ENABLED'] or not _compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    # the etag of a 304 has to match the one the full page was sent with
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    # files sent straight from disk, partial content and empty bodies are left alone
+    if response.direct_passthrough or response.status_code != 200:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(encoding, response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(encoding, data))
+    response.headers['Content-Encoding'] = encoding
+    return response
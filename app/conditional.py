@@ -0,0 +1,122 @@
+import hashlib
+import os
+import time
+from flask import request, session, make_response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from app import app, db
+from app.models import Inventory, Item, Loan
+from app import notifications
+
+# conditional GETs (ETag / Last-Modified) for the inventory pages
+#
+# each page says which rows it is built from, e.g. "the items in inventory 3".
+# one SELECT gets the newest updated_at and the row count of each of them (the
+# count catches deletes) plus the unread notification count for the navbar, and
+# they are hashed with who is asking into an ETag. if the browser already has
+# that ETag the page answers 304 without loading or rendering anything.
+#
+# Last-Modified is sent too, but a 304 is only given for a matching ETag as a
+# date can't tell that someone else (or nobody) is now logged in.
+#
+# pages are sent with "Cache-Control: private, no-cache" so browsers check with
+# us every time and shared caches never keep one users page for another.
+
+# the templates are part of every page so a deploy that changes them changes
+# every ETag (worked out from their modification times when the app starts)
+def _templates_version():
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(app.jinja_loader.searchpath[0])):
+        for name in sorted(files):
+            digest.update(f'{name}:{os.path.getmtime(os.path.join(root, name))}'.encode())
+    return digest.hexdigest()
+
+
+TEMPLATES_VERSION = _templates_version()
+
+
+# the rows of a model matching the conditions, as the two scalar subqueries the
+# validator query selects (newest change and how many there are)
+def rows(model, *where, join=None):
+    def subquery(column):
+        query = db.select(column).select_from(model)
+        if join is not None:
+            query = query.join(join)
+        return query.where(*where).scalar_subquery()
+    return [subquery(db.func.max(model.updated_at)), subquery(db.func.count())]
+
+
+# the rows each page is built from
+def inventories():
+    return rows(Inventory)
+
+
+def inventory(inventory_id):
+    return rows(Inventory, Inventory.id == inventory_id) + rows(Item, Item.inventory_id == inventory_id)
+
+
+def owned_inventory(user_id):
+    return rows(Inventory, Inventory.owner_id == user_id) + rows(Item, Inventory.owner_id == user_id, join=Item.inventory)
+
+
+def owned_loans(user_id):
+    # the loans of the owners items (for the pending loans count)
+    return rows(Loan, Loan.owner_id == user_id)
+
+
+def borrowed_from(inventory_id, user_id):
+    return rows(Loan, Loan.borrower_id == user_id, Item.inventory_id == inventory_id, join=Loan.item)
+
+
+class Validator:
+    # csrf is whether the page has forms on it, their token is part of the ETag
+    def __init__(self, *sources, csrf=True):
+        columns = [column for source in sources for column in source]
+        user_id = current_user.id if current_user.is_authenticated else None
+        if user_id is not None:
+            columns.append(notifications.unread_query(user_id).scalar_subquery())
+        row = db.session.execute(db.select(*columns)).one()
+
+        # a short version of each source's rows, in the order they were given.
+        # the views key the data they cache for the page on it, so a change made
+        # by another process (which this ones cache never heard of) can't be
+        # sent under the new ETag
+        values = iter(row)
+        self.versions = [_digest(tuple(next(values) for _ in source))[:16] for source in sources]
+
+        changes = [value for value in row if hasattr(value, 'timestamp')]
+        # http dates only go down to the second
+        self.last_modified = max(changes).replace(microsecond=0) if changes else None
+
+        token, bucket = None, 0
+        if csrf:
+            # the token is made by the first page that needs one, so it is made
+            # here to give the sessions first page the same ETag as the rest
+            generate_csrf()
+            token = session.get('csrf_token')
+            # the forms csrf token expires after WTF_CSRF_TIME_LIMIT, so pages
+            # are re-rendered at least twice as often
+            limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 0
+            bucket = int(time.time() // (limit / 2)) if limit else 0
+        self.etag = _digest((TEMPLATES_VERSION, request.full_path, user_id, token, bucket, tuple(row)))
+
+    # whether the browser has this page already. pages with messages waiting to
+    # be flashed are always rendered, the copy the browser has won't show them
+    def fresh(self):
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return False
+        return request.if_none_match.contains_weak(self.etag)
+
+    # the response to send, the rendered page or a 304 without one
+    def response(self, body=None):
+        response = make_response(body, 200) if body is not None else make_response('', 304)
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+
+
+def _digest(values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()
@@ -0,0 +1,64 @@
+import random
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
+
+# engine tuning that has to happen on each new connection
+
+
+def sqlite_pragmas(config):
+    return [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+    ]
+
+
+# run the configured pragmas on every connection the engine opens
+# (they only last as long as the connection, apart from journal_mode=WAL which
+# is stored in the database file)
+def configure_engine(engine, config):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+
+# raised inside a transaction when a compare-and-set update finds a row has
+# changed since it was read, run_transaction rolls back and tries again
+class Conflict(Exception):
+    pass
+
+
+# postgres serialization failure and deadlock, sqlite lock timeouts
+def _is_retryable(error):
+    if isinstance(error, (Conflict, StaleDataError)):
+        return True
+    if getattr(error.orig, 'pgcode', None) in ('40001', '40P01'):
+        return True
+    return 'database is locked' in str(error.orig)
+
+
+# run work() and commit, retrying a few times (after a short random wait so
+# clashing workers don't clash again) if it hit a conflicting change
+def run_transaction(session, work, attempts=5):
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work()
+            session.commit()
+            return result
+        except (Conflict, StaleDataError, DBAPIError) as e:
+            session.rollback()
+            if attempt == attempts or not _is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
@@ -0,0 +1,168 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# streamed table exports (csv and xlsx)
+#
+# both writers take a header and an iterable of rows and return a generator of
+# bytes, so a view can hand them rows straight from a yield_per query and
+# flask sends each chunk as soon as it is ready. nothing ever holds more than
+# one chunk of rows, however big the table is.
+#
+# the xlsx file is written by hand (it is a zip of a few xml files) so no
+# extra library is needed, cells are inline strings or plain numbers.
+
+# rows written between yields
+CHUNK_ROWS = 500
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def stream_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # the byte order mark makes excel read the file as utf-8
+    buffer.write('\ufeff')
+    writer.writerow(header)
+
+    for number, row in enumerate(rows, 1):
+        writer.writerow([_cell_text(value) for value in row])
+        if number % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# characters xml 1.0 doesn't allow, even escaped
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value):
+    # bool is an int too but reads better as text
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return '<c><v>%r</v></c>' % value
+    text = _INVALID_XML.sub('', _cell_text(value))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(text)
+
+
+def _xlsx_row(row):
+    return '<row>%s</row>' % ''.join(_xlsx_cell(value) for value in row)
+
+
+# characters excel doesn't allow in a sheet name
+_INVALID_SHEET_NAME = re.compile(r'[\[\]:*?/\\]')
+
+
+# a sheet name excel will open: at most 31 characters, none of []:*?/\, not
+# starting or ending with an apostrophe and not empty
+def _sheet_name(name):
+    name = _INVALID_SHEET_NAME.sub('', _INVALID_XML.sub('', name or ''))[:31].strip().strip("'")
+    return name or 'Sheet1'
+
+
+class _Chunks:
+    # write-only file for zipfile, whatever has been written is taken with pop()
+    # (it has no tell/seek so zipfile writes entries in streaming mode)
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet1'):
+    out = _Chunks()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        # the name is an attribute value so quotes have to be escaped too
+        archive.writestr('xl/workbook.xml', _WORKBOOK % escape(_sheet_name(sheet_name), {'"': '&quot;'}))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+
+        # force_zip64 as the size of the sheet isn't known until it's written
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((_SHEET_START + _xlsx_row(header)).encode('utf-8'))
+            chunk = []
+            for row in rows:
+                chunk.append(_xlsx_row(row))
+                if len(chunk) == CHUNK_ROWS:
+                    sheet.write(''.join(chunk).encode('utf-8'))
+                    chunk = []
+                    yield out.pop()
+            sheet.write((''.join(chunk) + _SHEET_END).encode('utf-8'))
+    yield out.pop()
+
+
+def stream_table(fmt, header, rows, sheet_name='Sheet1'):
+    if fmt == 'csv':
+        return stream_csv(header, rows)
+    return stream_xlsx(header, rows, sheet_name)
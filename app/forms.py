@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, DateField, SubmitField, SelectField, BooleanField, PasswordField, SubmitField, TextAreaField, SelectMultipleField
 from wtforms.validators import DataRequired, Email, EqualTo, Length
 
@@ -22,42 +23,46 @@ class CreateInventoryForm(FlaskForm):
     description = TextAreaField('Description')
     submit = SubmitField('Create')
 
+# item rules, shared with the bulk import (app/importer.py) so both check items the same way
+ITEM_NAME_MAX_LENGTH = 100
+ITEM_DESCRIPTION_MAX_LENGTH = 500
+ITEM_LOAN_STATUS_CHOICES = [
+    ('available', 'Available'),
+    ('on_loan', 'On Loan'),
+    ('unavailable', 'Unavailable')
+]
+ITEM_CONDITION_CHOICES = [
+    ('functional', 'Functional'),
+    ('minor_repair', 'Minor Repair'),
+    ('under_repair', 'Under Repair'),
+    ('out_of_service', 'Out of Service'),
+    ('missing_parts', 'Missing Parts'),
+    ('inspection_needed', 'Inspection Needed')
+]
+
 class CreateItemForm(FlaskForm):
-    name = StringField('Name', validators=[DataRequired(), Length(max=100)])
-    description = TextAreaField('Description', validators=[Length(max=500)])
+    name = StringField('Name', validators=[DataRequired(), Length(max=ITEM_NAME_MAX_LENGTH)])
+    description = TextAreaField('Description', validators=[Length(max=ITEM_DESCRIPTION_MAX_LENGTH)])
     loan_status = SelectField(
         'Loan Status',
-        choices=[
-            ('available', 'Available'),
-            ('on_loan', 'On Loan'),
-            ('unavailable', 'Unavailable')
-        ],
+        choices=ITEM_LOAN_STATUS_CHOICES,
         validators=[DataRequired()]
     )
     condition = SelectField(
         'Condition',
-        choices=[
-            ('functional', 'Functional'),
-            ('minor_repair', 'Minor Repair'),
-            ('under_repair', 'Under Repair'),
-            ('out_of_service', 'Out of Service'),
-            ('missing_parts', 'Missing Parts'),
-            ('inspection_needed', 'Inspection Needed')
-        ],
+        choices=ITEM_CONDITION_CHOICES,
         validators=[DataRequired()]
     )
+    photo_file = FileField('Photo', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'], 'JPEG, PNG, GIF or WEBP images only')])
+    # only shown when editing an item that has a photo
+    remove_photo = BooleanField('Remove photo')
     submit = SubmitField('Create Item')
 
-    
-class DeleteItemButtonForm(FlaskForm):
-    submit = SubmitField('Delete')
-
-class EditItemButtonForm(FlaskForm):
-    submit = SubmitField('Edit')
-
-class LoanButtonForm(FlaskForm):
-    submit = SubmitField("Loan")
+class ImportItemsForm(FlaskForm):
+    file = FileField('File', validators=[FileRequired(), FileAllowed(['csv', 'json', 'jsonl'], 'CSV or JSON files only')])
+    submit = SubmitField('Import')
 
+    
 class CancelLoanButtonForm(FlaskForm):
     submit = SubmitField("Cancel")
 
@@ -72,3 +77,13 @@ class RejectButtonForm(FlaskForm):
 
 class ApproveButtonForm(FlaskForm):
     submit = SubmitField('Approve')
+
+# approve or reject the loan requests ticked on the manage loans page
+class BulkLoanForm(FlaskForm):
+    approve = SubmitField('Approve Selected')
+    reject = SubmitField('Reject Selected')
+
+# mark the notifications ticked on the notifications page (or all of them) read
+class MarkNotificationsReadForm(FlaskForm):
+    selected = SubmitField('Mark Selected Read')
+    all = SubmitField('Mark All Read')
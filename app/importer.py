@@ -0,0 +1,200 @@
+import codecs
+import csv
+import io
+import json
+from sqlalchemy import insert
+from app import db, cache, search, stats
+from app.forms import ITEM_NAME_MAX_LENGTH, ITEM_DESCRIPTION_MAX_LENGTH, ITEM_LOAN_STATUS_CHOICES, ITEM_CONDITION_CHOICES
+from app.models import Item
+
+# bulk item import from csv or json files
+#
+# the file is read a row at a time and valid rows are inserted in batches
+# (one multi-row INSERT per batch, committed on its own) so memory stays flat
+# however big the file is. invalid rows are skipped and reported with their
+# line (csv) or position (json) instead of stopping the import.
+#
+# csv files need a header row, json files can be an array of objects or one
+# object per line. the columns/keys are name, description, loan_status and condition.
+
+BATCH_SIZE = 1000
+# only this many row errors are kept to show the user, the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+LOAN_STATUSES = {value for value, label in ITEM_LOAN_STATUS_CHOICES}
+CONDITIONS = {value for value, label in ITEM_CONDITION_CHOICES}
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        # set if the file itself couldn't be read past some point
+        self.format_error = None
+        # (row number, [messages])
+        self.errors = []
+
+    def add_error(self, row_number, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, messages))
+
+
+def _text(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+# check a row with the same rules as CreateItemForm
+# returns the values to insert and a list of problems (empty if the row is fine)
+# with partial=True only the fields present in the row are checked and returned
+# (for updates)
+def validate_item_row(row, partial=False):
+    if not isinstance(row, dict):
+        return None, ['Row must be an object with name, description, loan_status and condition.']
+
+    values = {}
+    errors = []
+
+    if not partial or 'name' in row:
+        name = _text(row.get('name'))
+        if not name or not name.strip():
+            errors.append('name: This field is required.')
+        elif len(name) > ITEM_NAME_MAX_LENGTH:
+            errors.append('name: Field cannot be longer than %d characters.' % ITEM_NAME_MAX_LENGTH)
+        values['name'] = name
+
+    if not partial or 'description' in row:
+        description = _text(row.get('description'))
+        if description and len(description) > ITEM_DESCRIPTION_MAX_LENGTH:
+            errors.append('description: Field cannot be longer than %d characters.' % ITEM_DESCRIPTION_MAX_LENGTH)
+        values['description'] = description or ''
+
+    for field, choices in (('loan_status', LOAN_STATUSES), ('condition', CONDITIONS)):
+        if not partial or field in row:
+            value = _text(row.get(field))
+            if not value:
+                errors.append('%s: This field is required.' % field)
+            elif value not in choices:
+                errors.append('%s: Not a valid choice.' % field)
+            values[field] = value
+
+    if errors:
+        return None, errors
+    return values, []
+
+
+# yields (line number, row) from a binary csv stream
+def iter_csv_rows(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, row
+
+
+# yields (position, row) from a binary stream holding a json array of objects
+# or json lines, decoding one object at a time instead of loading the whole file
+def iter_json_rows(stream, chunk_size=64 * 1024):
+    decoder = json.JSONDecoder()
+    text = codecs.getreader('utf-8-sig')(stream)
+    buffer = ''
+    pos = 0
+    eof = False
+    number = 0
+
+    def more():
+        nonlocal buffer, pos, eof
+        data = text.read(chunk_size)
+        if not data:
+            eof = True
+        buffer = buffer[pos:] + data
+        pos = 0
+
+    while True:
+        # skip whitespace and the brackets/commas between objects
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            more()
+        if pos >= len(buffer):
+            return
+
+        try:
+            row, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # the object might just carry on in the next chunk
+            if eof:
+                raise ImportFormatError('Invalid JSON after row %d: %s' % (number, e.msg))
+            more()
+            continue
+
+        number += 1
+        pos = end
+        yield number, row
+
+
+def iter_rows(stream, filename):
+    if filename.lower().endswith('.csv'):
+        return iter_csv_rows(stream)
+    if filename.lower().endswith(('.json', '.jsonl', '.ndjson')):
+        return iter_json_rows(stream)
+    raise ImportFormatError('Unsupported file type, use .csv, .json or .jsonl')
+
+
+def _insert_batch(inventory_id, batch, index_in_background):
+    # one multi-row INSERT ... RETURNING for the whole batch, in its own transaction
+    ids = db.session.execute(insert(Item).returning(Item.id), batch).scalars().all()
+    deltas = stats.Deltas()
+    for row in batch:
+        deltas.item(inventory_id, row['loan_status'], row['condition'])
+    deltas.apply()
+    if index_in_background and ids:
+        search.queue_inventory_items(inventory_id, min(ids), max(ids))
+    db.session.commit()
+    cache.invalidate(cache.inventory_namespace(inventory_id))
+    return ids
+
+
+# import the rows into the inventory, returns an ImportResult
+# each batch is added to the search index by a background job queued with it by
+# default so a big upload doesn't wait for it, otherwise everything is indexed
+# at the end
+def import_items(inventory_id, rows, batch_size=BATCH_SIZE, index_in_background=True):
+    result = ImportResult()
+    batch = []
+    first_id = last_id = None
+
+    def flush():
+        nonlocal first_id, last_id
+        ids = _insert_batch(inventory_id, batch, index_in_background)
+        result.imported += len(ids)
+        if ids:
+            first_id = min(ids) if first_id is None else min(first_id, min(ids))
+            last_id = max(ids) if last_id is None else max(last_id, max(ids))
+        batch.clear()
+
+    try:
+        for row_number, row in rows:
+            values, errors = validate_item_row(row)
+            if errors:
+                result.add_error(row_number, errors)
+                continue
+            values['inventory_id'] = inventory_id
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+    except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+        # keep the rows read so far, earlier batches are already committed anyway
+        result.format_error = str(e)
+    if batch:
+        flush()
+
+    if first_id is not None and not index_in_background:
+        search.index_inventory_items(inventory_id, first_id, last_id)
+    return result
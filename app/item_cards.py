@@ -0,0 +1,107 @@
+import uuid
+from flask import current_app, url_for
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from app import app
+from app.cache import MemoryCache, NullCache, MISS
+from app.models import Item
+
+# what the item cards on my inventory and view inventory need, shared by every
+# page (templates/inventory/cards.html renders them)
+#
+# the cards used to build WTForms button forms and call url_for for every item.
+# now a page takes one csrf token, the badge colours and labels are looked up
+# in the tables below and each link is a prefix worked out once per page with
+# the item id added on the end in the template.
+#
+# each rendered card is also kept in a per process LRU cache (CARD_CACHE_MAX_BYTES)
+# keyed by the item's id, version and updated_at (sqlite can give a deleted
+# item's id to a new one, which starts at version 1 again), and for view inventory by what the card
+# shows this user (whether they can ask for it or have already). only the cards
+# of items that changed are rendered again, the rest of the page is pasted
+# together from the cache. the csrf token differs per session so cards are
+# cached with a placeholder, swapped for the token once the page is joined up.
+
+REPAIR_STATUS_BADGE = {
+    "functional": "success",
+    "minor_repair": "warning",
+    "under_repair": "info",
+    "out_of_service": "danger",
+    "missing_parts": "secondary",
+    "inspection_needed": "primary",
+}
+
+# "requested" is shown on view inventory for items the user has already asked for
+LOAN_STATUS_BADGE = {
+    "available": "success",
+    "on_loan": "warning",
+    "requested": "warning",
+    "unavailable": "secondary",
+}
+
+# "minor_repair" -> "Minor Repair"
+STATUS_LABELS = {
+    status: status.title().replace("_", " ")
+    for status in list(Item.condition.type.enums) + list(Item.loan_status.type.enums) + ['requested']
+}
+
+
+# the url of an endpoint whose last part is the given argument, with that part
+# left off (e.g. "/delete/") so the template can add each item's id itself
+def url_prefix(endpoint, argument):
+    return url_for(endpoint, **{argument: '0'})[:-1]
+
+
+# template variables the card macros need
+def page_context():
+    return {
+        'thumb_size': current_app.config['PHOTO_THUMB_SIZE'],
+        'repair_status_badge': REPAIR_STATUS_BADGE,
+        'loan_status_badge': LOAN_STATUS_BADGE,
+        'status_labels': STATUS_LABELS,
+        'edit_url': url_prefix('edit_item', 'item_id'),
+        'delete_url': url_prefix('delete_item', 'item_id'),
+        'loan_url': url_prefix('loan_request', 'item_id'),
+        'thumbnail_url': url_prefix('item_thumbnail', 'name'),
+    }
+
+
+# random so no item description can contain it
+CSRF_PLACEHOLDER = 'csrf-%s' % uuid.uuid4().hex
+
+if app.config['CARD_CACHE_MAX_BYTES']:
+    card_cache = MemoryCache(app.config['CARD_CACHE_MAX_ENTRIES'], None, app.config['CARD_CACHE_MAX_BYTES'])
+else:
+    card_cache = NullCache()
+
+
+# the html of every card on a page, cards is a list of (cache key, macro arguments)
+def _render(macro, cards):
+    module = None
+    parts = []
+    for key, args in cards:
+        html = card_cache.get(key)
+        if html is MISS:
+            # the macros (and the links they need) are only loaded if some card has to be rendered
+            if module is None:
+                context = dict(page_context(), user_logged_in=current_user.is_authenticated)
+                module = current_app.jinja_env.get_template('inventory/cards.html').make_module(context)
+            html = str(getattr(module, macro)(*args, CSRF_PLACEHOLDER))
+            card_cache.set(key, html)
+        parts.append(html)
+    return Markup(''.join(parts).replace(CSRF_PLACEHOLDER, generate_csrf()))
+
+
+# the cards for my inventory
+def owner_cards(page):
+    return _render('owner_card', [(('owner', item.id, item.version, item.updated_at), (item,)) for item in page])
+
+
+# the cards for view inventory, requested_item_ids are the items the user has asked for
+def borrower_cards(page, requested_item_ids):
+    logged_in = current_user.is_authenticated
+    return _render('borrower_card', [
+        (('borrower', item.id, item.version, item.updated_at, logged_in, item.id in requested_item_ids), (item, item.id in requested_item_ids))
+        for item in page
+    ])
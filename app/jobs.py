@@ -0,0 +1,195 @@
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event
+from app import app, db
+from app.models import Job
+
+# a small durable queue for slow side effects (emails, search index updates)
+#
+# jobs are rows in the jobs table. enqueue() adds one to the current transaction,
+# so a job is committed together with the change it belongs to (never lost, never
+# run for a change that was rolled back) and queued jobs survive restarts.
+#
+# each web process runs JOBS_WORKERS worker threads (started on its first
+# request), "flask run-jobs" runs them on their own. a worker takes a job with a
+# compare-and-set UPDATE like the loans do, so any number of threads and
+# processes can share the table without running a job twice. a job that raises
+# is retried with exponential backoff, after JOBS_MAX_ATTEMPTS tries it is left
+# as failed ("flask retry-failed-jobs" queues them again). a job whose worker
+# died is taken again once its lock is JOBS_LOCK_TIMEOUT seconds old, so
+# handlers should be safe to run twice.
+
+log = logging.getLogger(__name__)
+
+_handlers = {}
+
+# set when jobs are committed so idle workers don't wait for the next poll
+_wakeup = threading.Event()
+
+
+# register a function as the handler for a kind of job, it is called with the
+# payload as keyword arguments inside an app context
+def handler(kind):
+    def register(function):
+        _handlers[kind] = function
+        return function
+    return register
+
+
+# queue a job in the current transaction (it is run once that commits)
+# the payload has to be json serialisable
+def enqueue(kind, delay=0, **payload):
+    db.session.add(Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=current_app.config['JOBS_MAX_ATTEMPTS'],
+    ))
+    db.session.info['jobs_queued'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_queued', False):
+        _wakeup.set()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_jobs(session):
+    session.info.pop('jobs_queued', None)
+
+
+# seconds to wait before trying a job again after its nth failed attempt
+# (doubling each time, with some jitter so failed jobs don't all come back at once)
+def _backoff(attempts):
+    config = current_app.config
+    delay = min(config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1), config['JOBS_MAX_RETRY_DELAY'])
+    return delay * random.uniform(0.75, 1.25)
+
+
+# take the next due job, returns None if there isn't one
+def _claim():
+    for _ in range(5):
+        now = datetime.utcnow()
+        lost = now - timedelta(seconds=current_app.config['JOBS_LOCK_TIMEOUT'])
+        due = ((Job.status == 'queued') & (Job.run_at <= now)) | ((Job.status == 'running') & (Job.locked_at < lost))
+        job_id = db.session.scalar(db.select(Job.id).where(due).order_by(Job.run_at, Job.id).limit(1))
+        if job_id is None:
+            db.session.rollback()
+            return None
+        # only changes the row if no other worker has taken it since the select
+        job = db.session.execute(
+            db.update(Job)
+            .where(Job.id == job_id, due)
+            .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.session.commit()
+        if job is not None:
+            return job
+    return None
+
+
+# run the next due job, returns False if there wasn't one
+def run_one():
+    job = _claim()
+    if job is None:
+        return False
+
+    # the updates below only apply if the job wasn't taken over in the meantime
+    mine = db.update(Job).where(Job.id == job.id, Job.attempts == job.attempts).execution_options(synchronize_session=False)
+    try:
+        _handlers[job.kind](**json.loads(job.payload))
+    except Exception as e:
+        db.session.rollback()
+        error = '%s: %s' % (type(e).__name__, e)
+        if job.attempts >= job.max_attempts:
+            log.exception('job %d (%s) failed for good', job.id, job.kind)
+            db.session.execute(mine.values(status='failed', locked_at=None, last_error=error))
+        else:
+            log.warning('job %d (%s) failed, will retry: %s', job.id, job.kind, error)
+            run_at = datetime.utcnow() + timedelta(seconds=_backoff(job.attempts))
+            db.session.execute(mine.values(status='queued', locked_at=None, run_at=run_at, last_error=error))
+    else:
+        db.session.execute(db.delete(Job).where(Job.id == job.id, Job.attempts == job.attempts))
+    db.session.commit()
+    return True
+
+
+# run jobs until none are due, returns how many were run
+def run_pending():
+    count = 0
+    while run_one():
+        count += 1
+    return count
+
+
+# queue the failed jobs again, returns how many there were
+def retry_failed():
+    count = db.session.execute(
+        db.update(Job)
+        .where(Job.status == 'failed')
+        .values(status='queued', attempts=0, run_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    _wakeup.set()
+    return count
+
+
+class Workers:
+    def __init__(self, flask_app, threads, poll_interval):
+        self.app = flask_app
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._work, name='job-worker-%d' % n, daemon=True) for n in range(threads)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        _wakeup.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                with self.app.app_context():
+                    ran = run_one()
+            except Exception:
+                # e.g. the database is unreachable, try again later
+                log.exception('job worker error')
+                ran = False
+            if not ran:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+
+def start_workers(threads=None):
+    global _workers
+    with _workers_lock:
+        if _workers is None:
+            config = app.config
+            _workers = Workers(app, config['JOBS_WORKERS'] if threads is None else threads, config['JOBS_POLL_INTERVAL'])
+            _workers.start()
+    return _workers
+
+
+# the web process starts its workers when it gets its first request
+@app.before_request
+def _start_workers_on_first_request():
+    if _workers is None and current_app.config['JOBS_WORKERS'] > 0:
+        start_workers()
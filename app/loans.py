@@ -0,0 +1,266 @@
+from datetime import datetime
+from flask import url_for
+from app import db, cache, stats, notifications
+from app.database import Conflict, run_transaction
+from app.models import Inventory, Item, Loan
+
+# requesting, approving, rejecting and returning loans
+#
+# every change is a compare-and-set: the UPDATE/INSERT/DELETE repeats the
+# condition it depends on (the item is available, the loan is still pending, ...)
+# in its WHERE clause and looks at what it actually changed, so two workers
+# acting on the same item at once can't both succeed. in particular an item is
+# only ever lent out by the statement that moves it from available to on_loan,
+# so it can't end up with two approved loans.
+#
+# the functions that change several rows run in run_transaction, which rolls
+# back and retries if a statement finds the world changed half way through.
+# the inventory counters (app/stats.py) are adjusted and the notifications
+# (app/notifications.py) written in the same transaction.
+
+
+# a borrower can only have one loan in these states per item, once a request
+# is rejected or the item returned they can ask again
+OPEN_STATUSES = ['pending', 'approved']
+
+
+class LoanDecisions:
+    def __init__(self):
+        self.approved = []
+        self.rejected = []
+        # other pending requests for items that have just been lent out
+        self.auto_rejected = []
+        # loan ids that weren't pending requests for this owner, or whose item
+        # couldn't be lent out
+        self.skipped = []
+        # inventories whose item listings changed (for cache invalidation)
+        self.inventory_ids = set()
+
+
+# approve the owners pending requests in loan_ids and mark their items on loan
+# only items that are available can be lent, and if several of the requests are
+# for the same item the oldest one wins. every other pending request for an item
+# that gets lent out is rejected
+def approve_loans(owner_id, loan_ids, decisions):
+    if not loan_ids:
+        return
+
+    rows = db.session.execute(
+        db.select(Loan.id, Loan.item_id, Item.inventory_id)
+        .join(Loan.item)
+        .where(
+            Loan.id.in_(loan_ids),
+            Loan.owner_id == owner_id,
+            Loan.status == 'pending',
+            Item.loan_status == 'available',
+        )
+        .order_by(Loan.id)
+    ).all()
+
+    winners = {}
+    for loan_id, item_id, inventory_id in rows:
+        winners.setdefault(item_id, (loan_id, inventory_id))
+    if not winners:
+        return
+
+    # claim the items first, only the ones still available are changed (anything
+    # lent out since the select above is left alone and its requests skipped)
+    claimed = db.session.execute(
+        db.update(Item)
+        .where(Item.id.in_(winners), Item.loan_status == 'available')
+        .values(loan_status='on_loan', version=Item.version + 1)
+        .returning(Item.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not claimed:
+        return
+
+    # the select ran before the write transaction began, so the loan must still
+    # be the same request (for the claimed item, from this owner) it was then
+    winning_loans = {winners[item_id][0]: item_id for item_id in claimed}
+    approved = db.session.execute(
+        db.update(Loan)
+        .where(
+            Loan.id.in_(winning_loans),
+            Loan.item_id.in_(claimed),
+            Loan.owner_id == owner_id,
+            Loan.status == 'pending',
+        )
+        .values(status='approved', approved_date=datetime.utcnow())
+        .returning(Loan.id, Loan.item_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    # a request was cancelled or decided since the select, start again
+    if dict(approved) != winning_loans:
+        raise Conflict()
+    approved = [loan_id for loan_id, _ in approved]
+
+    auto_rejected = db.session.execute(
+        db.update(Loan)
+        .where(Loan.item_id.in_(claimed), Loan.status == 'pending')
+        .values(status='rejected')
+        .returning(Loan.id, Loan.item_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    deltas = stats.Deltas()
+    for item_id in claimed:
+        deltas.loan_status(winners[item_id][1], 'available', 'on_loan')
+        deltas.pending_loans(winners[item_id][1], -1)
+    for _, item_id in auto_rejected:
+        deltas.pending_loans(winners[item_id][1], -1)
+    deltas.apply()
+
+    decisions.approved.extend(sorted(approved))
+    decisions.auto_rejected.extend(sorted(loan_id for loan_id, _ in auto_rejected))
+    decisions.inventory_ids.update(winners[item_id][1] for item_id in claimed)
+
+
+# reject the owners pending requests in loan_ids
+def reject_loans(owner_id, loan_ids, decisions):
+    if not loan_ids:
+        return
+
+    rejected = db.session.execute(
+        db.update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.owner_id == owner_id, Loan.status == 'pending')
+        .values(status='rejected')
+        .returning(Loan.id, Loan.item_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    stats.pending_loans_changed([item_id for _, item_id in rejected], -1)
+
+    decisions.rejected.extend(sorted(loan_id for loan_id, _ in rejected))
+
+
+# approve and reject loans for an owner in one transaction, returns LoanDecisions
+def decide(owner_id, approve=(), reject=()):
+    approve, reject = set(approve), set(reject)
+
+    def work():
+        decisions = LoanDecisions()
+        approve_loans(owner_id, approve, decisions)
+        reject_loans(owner_id, reject, decisions)
+        batch = notifications.Batch()
+        link = url_for('view_loan_requests')
+        batch.loans(decisions.approved, 'borrower', notifications.APPROVED, link)
+        batch.loans(decisions.rejected + decisions.auto_rejected, 'borrower', notifications.REJECTED, link)
+        batch.send()
+        return decisions
+
+    decisions = run_transaction(db.session, work)
+    # a request already rejected because its item was just lent out isn't skipped
+    decisions.skipped = sorted(
+        (approve | reject) - set(decisions.approved) - set(decisions.rejected) - set(decisions.auto_rejected)
+    )
+    cache.invalidate(*[cache.inventory_namespace(inventory_id) for inventory_id in decisions.inventory_ids])
+    return decisions
+
+
+# ask to borrow an item, returns False if it isn't available or the borrower
+# already has a request in for it
+# (one INSERT ... SELECT so the checks and the insert can't be split by another request)
+def request_loan(borrower_id, item_id):
+    already_requested = db.select(Loan.id).where(
+        Loan.item_id == item_id,
+        Loan.borrower_id == borrower_id,
+        Loan.status.in_(OPEN_STATUSES),
+    ).exists()
+    new_loan = (
+        db.select(
+            Item.id,
+            db.literal(borrower_id),
+            Inventory.owner_id,
+            db.literal('pending'),
+            db.literal(datetime.utcnow(), db.DateTime),
+        )
+        .join(Item.inventory)
+        .where(Item.id == item_id, Item.loan_status == 'available', ~already_requested)
+    )
+
+    def work():
+        loan_id = db.session.execute(
+            db.insert(Loan)
+            .from_select(['item_id', 'borrower_id', 'owner_id', 'status', 'request_date'], new_loan)
+            .returning(Loan.id)
+        ).scalar()
+        if loan_id is None:
+            return False
+        stats.pending_loans_changed([item_id], 1)
+        batch = notifications.Batch()
+        batch.loans([loan_id], 'owner', notifications.REQUESTED, url_for('manage_loans'))
+        batch.send()
+        return True
+
+    return run_transaction(db.session, work)
+
+
+# give back an approved loan (the borrower or the owner can), the loan is
+# marked returned (and kept for the dashboard) and its item is available again.
+# returns False if it wasn't an approved loan of theirs
+def return_loan(user_id, loan_id):
+    def work():
+        returned = db.session.execute(
+            db.update(Loan)
+            .where(
+                Loan.id == loan_id,
+                Loan.status == 'approved',
+                (Loan.borrower_id == user_id) | (Loan.owner_id == user_id),
+            )
+            .values(status='returned', returned_date=datetime.utcnow())
+            .returning(Loan.item_id, Loan.borrower_id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if returned is None:
+            return False, None
+        inventory_id = db.session.execute(
+            db.update(Item)
+            .where(Item.id == returned.item_id, Item.loan_status == 'on_loan')
+            .values(loan_status='available', version=Item.version + 1)
+            .returning(Item.inventory_id)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if inventory_id is not None:
+            deltas = stats.Deltas()
+            deltas.loan_status(inventory_id, 'on_loan', 'available')
+            deltas.apply()
+        else:
+            # the owner already marked the item available by hand, the loan is
+            # still returned
+            inventory_id = db.session.execute(
+                db.select(Item.inventory_id).where(Item.id == returned.item_id)
+            ).scalar()
+        # tell whoever didn't hand it back
+        batch = notifications.Batch()
+        if returned.borrower_id == user_id:
+            batch.loans([loan_id], 'owner', notifications.RETURNED, url_for('manage_loans'))
+        else:
+            batch.loans([loan_id], 'borrower', notifications.RETURNED, url_for('view_loan_requests'))
+        batch.send()
+        return True, inventory_id
+
+    returned, inventory_id = run_transaction(db.session, work)
+    if inventory_id is not None:
+        cache.invalidate(cache.inventory_namespace(inventory_id))
+    return returned
+
+
+# remove a loan of the users that has one of the given statuses, returns False
+# if there wasn't one (e.g. it was approved in the meantime)
+def remove_loan(user_id, loan_id, statuses):
+    def work():
+        removed = db.session.execute(
+            db.delete(Loan)
+            .where(
+                Loan.id == loan_id,
+                Loan.status.in_(statuses),
+                (Loan.borrower_id == user_id) | (Loan.owner_id == user_id),
+            )
+            .returning(Loan.item_id, Loan.status)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if removed is not None and removed.status == 'pending':
+            stats.pending_loans_changed([removed.item_id], -1)
+        return removed is not None
+
+    return run_transaction(db.session, work)
@@ -0,0 +1,30 @@
+from flask import current_app
+from flask_mail import Mail, Message
+from app import app, db, jobs
+from app.models import Notification, User
+
+# email, only ever sent from background jobs so no request waits on smtp
+
+mail = Mail(app)
+
+
+# email each of the notifications to its user, over one smtp connection
+# (if the server fails part way the job is retried and the earlier ones are sent again)
+@jobs.handler('mail.notifications')
+def send_notifications(notification_ids):
+    rows = db.session.execute(
+        db.select(Notification.message, Notification.link, User.email, User.username)
+        .join(User, User.id == Notification.user_id)
+        .where(Notification.id.in_(notification_ids))
+        .order_by(Notification.id)
+    ).all()
+    if not rows:
+        return
+
+    site = current_app.config['SITE_URL'].rstrip('/')
+    with mail.connect() as connection:
+        for message, link, email, username in rows:
+            body = 'Hi %s,\n\n%s\n' % (username, message)
+            if link:
+                body += '\n%s%s\n' % (site, link)
+            connection.send(Message(subject='Inventory Manager: ' + message, recipients=[email], body=body))
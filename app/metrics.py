@@ -0,0 +1,151 @@
+import threading
+import time
+from flask import g, request, has_request_context, Response, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+
+# per endpoint request metrics
+#
+# for every request we count the sql statements it runs and time the request,
+# the sql and the template rendering. totals per endpoint are kept in memory and
+# served at /metrics in the prometheus text format. with METRICS_SERVER_TIMING on
+# each response also gets a Server-Timing header so the numbers show up in the
+# browser dev tools.
+#
+# the numbers are per process, prometheus adds them up across workers
+
+# upper bounds (seconds) of the request time histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.request_seconds = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _record(endpoint, duration, sql_statements, sql_seconds, render_seconds):
+    with _lock:
+        metrics = _metrics.get(endpoint)
+        if metrics is None:
+            metrics = _metrics[endpoint] = EndpointMetrics()
+        metrics.requests += 1
+        metrics.request_seconds += duration
+        metrics.sql_statements += sql_statements
+        metrics.sql_seconds += sql_seconds
+        metrics.render_seconds += render_seconds
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                metrics.bucket_counts[i] += 1
+                break
+
+
+# sql timing, listening on the Engine class catches every engine the app makes
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_start' in g:
+        g.sql_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_start' in g:
+        g.sql_statements += 1
+        g.sql_seconds += time.perf_counter() - g.pop('sql_start')
+
+
+# template timing (included templates are rendered as part of the outer one)
+@before_render_template.connect_via(app)
+def _before_render(sender, template, context, **extra):
+    if 'metrics_start' in g:
+        g.render_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _after_render(sender, template, context, **extra):
+    if 'render_start' in g:
+        g.render_seconds += time.perf_counter() - g.pop('render_start')
+
+
+@app.before_request
+def _start_request_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return
+    g.metrics_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+    g.render_seconds = 0.0
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    if 'metrics_start' not in g:
+        return response
+    duration = time.perf_counter() - g.metrics_start
+    # requests that didn't match a route are grouped together
+    endpoint = request.endpoint or 'unmatched'
+    if endpoint != 'metrics':
+        _record(endpoint, duration, g.sql_statements, g.sql_seconds, g.render_seconds)
+
+    if app.config['METRICS_SERVER_TIMING']:
+        response.headers.add('Server-Timing', 'sql;desc="%d queries";dur=%.2f, render;dur=%.2f, total;dur=%.2f' % (
+            g.sql_statements, g.sql_seconds * 1000, g.render_seconds * 1000, duration * 1000))
+    return response
+
+
+def _format(name, labels, value):
+    label_text = ','.join('%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"')) for key, val in labels)
+    return '%s{%s} %s' % (name, label_text, repr(float(value)) if isinstance(value, float) else value)
+
+
+def render_metrics():
+    with _lock:
+        snapshot = {endpoint: vars(metrics).copy() for endpoint, metrics in _metrics.items()}
+
+    lines = [
+        '# HELP inventory_requests_total Requests handled.',
+        '# TYPE inventory_requests_total counter',
+    ]
+    for endpoint, m in sorted(snapshot.items()):
+        lines.append(_format('inventory_requests_total', [('endpoint', endpoint)], m['requests']))
+
+    lines += [
+        '# HELP inventory_request_duration_seconds Time spent handling requests.',
+        '# TYPE inventory_request_duration_seconds histogram',
+    ]
+    for endpoint, m in sorted(snapshot.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, m['bucket_counts']):
+            cumulative += count
+            lines.append(_format('inventory_request_duration_seconds_bucket', [('endpoint', endpoint), ('le', bound)], cumulative))
+        lines.append(_format('inventory_request_duration_seconds_bucket', [('endpoint', endpoint), ('le', '+Inf')], m['requests']))
+        lines.append(_format('inventory_request_duration_seconds_sum', [('endpoint', endpoint)], m['request_seconds']))
+        lines.append(_format('inventory_request_duration_seconds_count', [('endpoint', endpoint)], m['requests']))
+
+    for name, key, help_text, kind in (
+        ('inventory_sql_statements_total', 'sql_statements', 'SQL statements run while handling requests.', 'counter'),
+        ('inventory_sql_duration_seconds_total', 'sql_seconds', 'Time spent running SQL while handling requests.', 'counter'),
+        ('inventory_template_render_seconds_total', 'render_seconds', 'Time spent rendering templates.', 'counter'),
+    ):
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind)]
+        for endpoint, m in sorted(snapshot.items()):
+            lines.append(_format(name, [('endpoint', endpoint)], m[key]))
+
+    return '\n'.join(lines) + '\n'
+
+
+# prometheus scrape endpoint
+@app.route('/metrics')
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        return Response('metrics are disabled\n', status=404, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
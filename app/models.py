@@ -2,6 +2,12 @@ from app import db
 from datetime import datetime
 from flask_login import UserMixin
 
+# when the row last changed, set by sqlalchemy on every insert and update
+# (including bulk update statements) so pages can tell if anything changed
+# since the browser last saw them (see app/conditional.py)
+def _updated_at(**kwargs):
+    return db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, **kwargs)
+
 #added cascade with help from 
 #https://stackoverflow.com/questions/5033547/sqlalchemy-cascade-delete
 # (casecade in this case means if the user is deleted all the data assosiated with there id is removed)
@@ -15,24 +21,34 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    inventories = db.relationship('Inventory', back_populates='owner', cascade='all, delete-orphan')
    
 # Inventories Table
 class Inventory(db.Model):
     __tablename__ = 'inventories'
 
     id = db.Column(db.Integer, primary_key=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = _updated_at(index=True)
+
+    owner = db.relationship('User', back_populates='inventories')
+    items = db.relationship('Item', back_populates='inventory', cascade='all, delete-orphan')
 
 
 # Items Table
 class Item(db.Model):
     __tablename__ = 'items'
+    __table_args__ = (
+        # the newest change to an inventorys items, for conditional GETs
+        db.Index('ix_items_inventory_id_updated_at', 'inventory_id', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    inventory_id = db.Column(db.Integer, db.ForeignKey('inventories.id', ondelete='CASCADE'), nullable=False)
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventories.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     loan_status = db.Column(
@@ -59,25 +75,139 @@ class Item(db.Model):
         default='functional'
     )
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # the name of its photo under PHOTO_DIR ("<sha256>.<ext>", see app/photos.py)
+    photo = db.Column(db.String(80), nullable=True)
+    updated_at = _updated_at()
+    # bumped on every change, orm updates only apply if it still has the value
+    # they loaded (StaleDataError otherwise), statements that change items in
+    # bulk bump it themselves
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    inventory = db.relationship('Inventory', back_populates='items')
+    loans = db.relationship('Loan', back_populates='item', cascade='all, delete-orphan')
+
+    __mapper_args__ = {'version_id_col': version}
 
 
 # Loans Table
 class Loan(db.Model):
     __tablename__ = 'loans'
+    __table_args__ = (
+        # manage loans looks up an owners loans (by status)
+        db.Index('ix_loans_owner_id_status', 'owner_id', 'status'),
+        # view loans looks up a borrowers loans and view inventory checks them per item
+        db.Index('ix_loans_borrower_id_item_id', 'borrower_id', 'item_id'),
+        # loans are deleted (cancelled, cleared), without AUTOINCREMENT sqlite
+        # would hand a deleted loans id to the next request
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id', ondelete='CASCADE'), nullable=False, index=True)
     borrower_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
-    owner_id = db.Column(db.Integer, nullable=True) 
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
     status = db.Column(db.Enum('pending', 'approved', 'rejected', 'returned', name='loan_status'), default='pending')
     request_date = db.Column(db.DateTime, default=datetime.utcnow)
+    approved_date = db.Column(db.DateTime, nullable=True)
+    returned_date = db.Column(db.DateTime, nullable=True)
+    updated_at = _updated_at()
+
+    # loans has two foreign keys to users so each relationship needs to say which one it uses
+    item = db.relationship('Item', back_populates='loans')
+    borrower = db.relationship('User', foreign_keys=[borrower_id])
+    owner = db.relationship('User', foreign_keys=[owner_id])
+
+def _counter():
+    return db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+# running totals for each inventory, kept up to date by app/stats.py in the same
+# transaction as the item and loan changes so summaries don't have to count items
+# (the loan status and condition columns are named after the values they count)
+class InventoryStats(db.Model):
+    __tablename__ = 'inventory_stats'
+
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventories.id', ondelete='CASCADE'), primary_key=True)
+    total_items = _counter()
+    pending_loans = _counter()
+
+    available = _counter()
+    on_loan = _counter()
+    unavailable = _counter()
+
+    functional = _counter()
+    minor_repair = _counter()
+    under_repair = _counter()
+    out_of_service = _counter()
+    missing_parts = _counter()
+    inspection_needed = _counter()
+
+# loan activity per inventory, month, item and borrower, filled in for finished
+# months by "flask rollup-loans" so the dashboard (app/analytics.py) doesn't have
+# to go through years of loans. item_id and borrower_id aren't foreign keys so the
+# history stays when items and users are deleted
+class LoanRollup(db.Model):
+    __tablename__ = 'loan_rollups'
 
-# un used, was planned but not implimented!
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventories.id', ondelete='CASCADE'), primary_key=True)
+    # "YYYY-MM"
+    month = db.Column(db.String(7), primary_key=True, index=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    borrower_id = db.Column(db.Integer, primary_key=True)
+
+    # requests made, loans approved and loans returned that month
+    requests = _counter()
+    loans = _counter()
+    returns = _counter()
+    # total length of the loans returned that month
+    loan_days = db.Column(db.Float, nullable=False, default=0, server_default='0')
+
+# background work queued by app/jobs.py
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # workers look for the next queued job that is due
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # name of the handler that runs it
+    kind = db.Column(db.String(100), nullable=False)
+    # json keyword arguments for the handler
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.Enum('queued', 'running', 'failed', name='job_status'), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    # not run before this time (retries are pushed back)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # when a worker took it, a job running for too long is taken again
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# tokens for the json api, only a hash of the token is stored
+class ApiToken(db.Model):
+    __tablename__ = 'api_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User')
+
+# messages to a user about their loans, sent by app/notifications.py
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # the navbar counts a users unread notifications on every page
+        db.Index('ix_notifications_user_id_is_read', 'user_id', 'is_read'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     message = db.Column(db.Text, nullable=False)
-    is_read = db.Column(db.Boolean, default=False)
+    # page the notification is about
+    link = db.Column(db.String(200), nullable=True)
+    is_read = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
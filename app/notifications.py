@@ -0,0 +1,84 @@
+from flask import current_app
+from flask_login import current_user
+from app import app, db, jobs
+from app.models import Notification, Loan, Item, User
+
+# notifications about loans (requested, approved, rejected, returned)
+#
+# they are collected in a Batch and written with one multi-row INSERT in the same
+# transaction as the loan changes they are about, so approving fifty requests
+# doesn't mean fifty commits and a rolled back change sends nothing.
+#
+# with LOAN_EMAILS on they are also emailed, by a job queued with them (app/mail.py).
+#
+# the navbar shows the number of unread ones on every page, which is a COUNT
+# on the (user_id, is_read) index.
+
+# messages, filled in with the item name and the borrowers username
+REQUESTED = '%(borrower)s asked to borrow %(item)s.'
+APPROVED = 'Your request to borrow %(item)s was approved.'
+REJECTED = 'Your request to borrow %(item)s was rejected.'
+RETURNED = '%(item)s has been returned.'
+
+
+class Batch:
+    def __init__(self):
+        # (loan id, "borrower" or "owner", message, link)
+        self.loan_messages = []
+        self.rows = []
+
+    # a message about each of the loans for their borrower or owner
+    def loans(self, loan_ids, recipient, message, link=None):
+        self.loan_messages.extend((loan_id, recipient, message, link) for loan_id in loan_ids)
+
+    def add(self, user_id, message, link=None):
+        self.rows.append({'user_id': user_id, 'message': message, 'link': link})
+
+    # write everything collected so far (without committing), and queue the emails
+    def send(self):
+        if self.loan_messages:
+            # the names for every loan in one query
+            loans = {row.id: row for row in db.session.execute(
+                db.select(Loan.id, Loan.borrower_id, Loan.owner_id, Item.name, User.username)
+                .join(Loan.item)
+                .join(Loan.borrower)
+                .where(Loan.id.in_({loan_id for loan_id, _, _, _ in self.loan_messages}))
+            )}
+            for loan_id, recipient, message, link in self.loan_messages:
+                loan = loans.get(loan_id)
+                user_id = loan and (loan.borrower_id if recipient == 'borrower' else loan.owner_id)
+                if user_id is not None:
+                    self.add(user_id, message % {'item': loan.name, 'borrower': loan.username}, link)
+        if self.rows:
+            ids = db.session.execute(db.insert(Notification).returning(Notification.id), self.rows).scalars().all()
+            if current_app.config['LOAN_EMAILS']:
+                jobs.enqueue('mail.notifications', notification_ids=ids)
+        self.loan_messages = []
+        self.rows = []
+
+
+def unread_query(user_id):
+    return db.select(db.func.count()).select_from(Notification).where(Notification.user_id == user_id, Notification.is_read == db.false())
+
+
+def unread_count(user_id):
+    return db.session.scalar(unread_query(user_id))
+
+
+# mark a users notifications read, all of them or only the given ids (commits)
+# returns how many were unread
+def mark_read(user_id, notification_ids=None):
+    query = db.update(Notification).where(Notification.user_id == user_id, Notification.is_read == db.false())
+    if notification_ids is not None:
+        query = query.where(Notification.id.in_(notification_ids))
+    count = db.session.execute(query.values(is_read=True).execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return count
+
+
+# the unread count for the navbar
+@app.context_processor
+def unread_notifications():
+    if not current_user.is_authenticated:
+        return {}
+    return {'unread_notifications': unread_count(current_user.id)}
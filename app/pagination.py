@@ -0,0 +1,88 @@
+from flask import request, current_app
+
+# keyset (cursor) pagination
+# instead of OFFSET (which has to walk past every skipped row) each page is fetched
+# with "WHERE id > last id seen ORDER BY id LIMIT n", so every page costs the same
+# no matter how far into the list the user is.
+# ids only ever go up so ordering by id is the same as ordering by created_at
+
+
+class Page:
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        # id to pass as ?after= for the next page and ?before= for the previous page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# page size from ?per_page= (capped) or the configured default
+def get_per_page():
+    default = current_app.config['PAGE_SIZE']
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+
+
+# identifies which page the request is for (used in cache keys)
+def page_key():
+    return '%s:%s:%d' % (request.args.get('after', ''), request.args.get('before', ''), get_per_page())
+
+
+# fetch one page of query ordered by column using the ?after= / ?before= cursors
+# (descending=True lists the newest rows first, ?after= then goes to older ones)
+def keyset_paginate(query, column, descending=False):
+    per_page = get_per_page()
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    if descending:
+        forward, backward = column.desc(), column.asc()
+        comes_after, comes_before = column.__lt__, column.__gt__
+    else:
+        forward, backward = column.asc(), column.desc()
+        comes_after, comes_before = column.__gt__, column.__lt__
+
+    # going backwards: read the rows just before the cursor in reverse then flip them
+    if before is not None:
+        rows = query.filter(comes_before(before)).order_by(backward).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        if not rows:
+            return Page(rows, per_page)
+        return Page(
+            rows,
+            per_page,
+            # there is always something after a page reached by going back
+            next_cursor=getattr(rows[-1], column.key),
+            prev_cursor=getattr(rows[0], column.key) if has_more else None,
+        )
+
+    if after is not None:
+        query = query.filter(comes_after(after))
+
+    # ask for one extra row to find out if there is another page without a COUNT
+    rows = query.order_by(forward).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not rows:
+        return Page(rows, per_page)
+    return Page(
+        rows,
+        per_page,
+        next_cursor=getattr(rows[-1], column.key) if has_more else None,
+        prev_cursor=getattr(rows[0], column.key) if after is not None else None,
+    )
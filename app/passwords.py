@@ -0,0 +1,162 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import app, db
+
+# password hashing and login admission control
+#
+# password hashes are slow on purpose (tens of milliseconds of cpu each). done on
+# the request thread a burst of logins would hold every worker and starve all the
+# other pages, so they are worked out in a small pool of processes instead. only
+# PASSWORD_HASH_MAX_PENDING can be running or waiting at once, past that Busy is
+# raised rather than queueing more work. the pool uses spawn, which imports the
+# __main__ module again in each worker, so scripts that start the app need an
+# if __name__ == '__main__' guard.
+#
+# PASSWORD_HASH_METHOD is the work factor. a stored hash made with a different
+# method is replaced with a new one when its user next logs in.
+#
+# before anything is hashed a login has to get past a per ip and a per account
+# rate limit (token buckets kept in this process), so a flood is turned away for
+# the cost of a dict lookup.
+
+
+# too many attempts or hashes in flight, try again in retry_after seconds
+class Busy(Exception):
+    def __init__(self, retry_after=1):
+        super().__init__('busy, retry after %d seconds' % retry_after)
+        self.retry_after = retry_after
+
+
+# token bucket per key: limit attempts, refilled evenly over period seconds
+class RateLimiter:
+    def __init__(self, limit, period, max_keys=100000):
+        self.limit = limit
+        self.rate = limit / period if limit else 0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # use up an attempt for key, returns 0 if it is allowed or else the seconds
+    # until it would be
+    def hit(self, key):
+        if not self.limit:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            # forget the keys that haven't been seen for longest
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+_config = app.config
+ip_limiter = RateLimiter(_config['LOGIN_IP_LIMIT'], _config['LOGIN_LIMIT_PERIOD'])
+account_limiter = RateLimiter(_config['LOGIN_ACCOUNT_LIMIT'], _config['LOGIN_LIMIT_PERIOD'])
+
+
+# raises Busy if the ip (or the account, for logins) has had too many attempts
+def admit(ip, account=None):
+    wait = ip_limiter.hit(ip)
+    if not wait and account is not None:
+        wait = account_limiter.hit(account.lower())
+    if wait:
+        raise Busy(int(wait) + 1)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(_config['PASSWORD_HASH_MAX_PENDING'])
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork, forking a process that has threads running isn't safe
+            _pool = ProcessPoolExecutor(_config['PASSWORD_HASH_WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# run function(*args) in the pool and wait for it
+def _run(function, *args):
+    if not _config['PASSWORD_HASH_WORKERS']:
+        return function(*args)
+    if not _slots.acquire(blocking=False):
+        raise Busy()
+    pool = _get_pool()
+    try:
+        future = pool.submit(function, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard_pool(pool)
+        raise Busy()
+    # the slot is only given back once the work is done, even if we stop waiting
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=_config['PASSWORD_HASH_TIMEOUT'])
+    except TimeoutError:
+        raise Busy()
+    except BrokenProcessPool:
+        # a worker process died, start a new pool next time
+        _discard_pool(pool)
+        raise Busy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _config['PASSWORD_HASH_METHOD'])
+
+
+# a hash of nothing in particular made with the current settings, checked against
+# when there is no such user so that takes as long as a wrong password
+_reference_hash = None
+
+
+def _get_reference_hash():
+    global _reference_hash
+    if _reference_hash is None:
+        _reference_hash = hash_password('reference password')
+    return _reference_hash
+
+
+# True if the hash was made with different settings from PASSWORD_HASH_METHOD
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _get_reference_hash().split('$', 1)[0]
+
+
+# check a login, user can be None (no such user). if the password is right but
+# was hashed with old settings it is rehashed (and committed)
+def check_login(user, password):
+    if user is None:
+        _run(check_password_hash, _get_reference_hash(), password)
+        return False
+    if not _run(check_password_hash, user.password, password):
+        return False
+    if needs_rehash(user.password):
+        try:
+            user.password = hash_password(password)
+            db.session.commit()
+        except Busy:
+            # they can still log in, it's redone another time
+            pass
+    return True
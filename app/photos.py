@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from flask import current_app
+from PIL import Image, ImageOps
+from app import app, db, jobs
+from app.models import Item
+
+# item photos
+#
+# photos are stored on disk under PHOTO_DIR named after the sha256 of their
+# contents ("<digest>.<ext>", in a sub directory per first two characters) so
+# the same picture uploaded twice is only stored once and a name never changes
+# what it points to, which lets the browser cache them forever. items keep the
+# name in items.photo.
+#
+# the cards show a PHOTO_THUMB_SIZE thumbnail instead of the photo. it is made
+# by a background job queued with the upload, until it exists the thumbnail url
+# redirects to the full photo.
+#
+# files aren't deleted when an item stops using them (another item might have
+# the same picture), "flask prune-photos" removes the ones nothing uses.
+
+# the formats that are accepted, and the extension they are saved with
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+NAME = re.compile(r'^([0-9a-f]{64})\.(jpg|png|gif|webp)$')
+
+
+class PhotoError(Exception):
+    pass
+
+
+def _directory():
+    return current_app.config['PHOTO_DIR']
+
+
+def path(name):
+    return os.path.join(_directory(), name[:2], name)
+
+
+def thumbnail_path(name):
+    return os.path.join(_directory(), 'thumbs', name[:2], NAME.match(name).group(1) + '.jpg')
+
+
+# True if name looks like a photo name (so it is safe to build a path from)
+def valid_name(name):
+    return NAME.match(name) is not None
+
+
+# write to path via a temporary file in the same directory, so nobody sees half a file
+def _write_atomically(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+# store an uploaded photo (a file object), returns its name
+# raises PhotoError if it isn't an image in one of the FORMATS or is too big
+def save(upload):
+    limit = current_app.config['PHOTO_MAX_BYTES']
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as data:
+        size = 0
+        for chunk in iter(lambda: upload.read(64 * 1024), b''):
+            size += len(chunk)
+            if size > limit:
+                raise PhotoError('Photos can be at most %d MB.' % (limit // (1024 * 1024)))
+            digest.update(chunk)
+            data.write(chunk)
+
+        data.seek(0)
+        try:
+            with Image.open(data) as image:
+                image_format = image.format
+                image.verify()
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            raise PhotoError('That file is not an image that can be read.')
+        if image_format not in FORMATS:
+            raise PhotoError('Photos have to be JPEG, PNG, GIF or WEBP images.')
+
+        name = '%s.%s' % (digest.hexdigest(), FORMATS[image_format])
+        if os.path.exists(path(name)):
+            # already stored by an earlier upload of the same picture, touched so
+            # prune() doesn't take it before this upload's item is committed
+            os.utime(path(name))
+        else:
+            data.seek(0)
+            _write_atomically(path(name), lambda f: f.write(data.read()))
+    return name
+
+
+# queue the thumbnail for a new photo (in the current transaction)
+def queue_thumbnail(name):
+    if not os.path.exists(thumbnail_path(name)):
+        jobs.enqueue('photos.thumbnail', name=name)
+
+
+@jobs.handler('photos.thumbnail')
+def make_thumbnail(name):
+    target = thumbnail_path(name)
+    if os.path.exists(target) or not os.path.exists(path(name)):
+        return
+    with Image.open(path(name)) as image:
+        # phones store pictures sideways and say which way up they go
+        image = ImageOps.exif_transpose(image)
+        # cropped to exactly the thumbnail size so the cards all line up
+        thumbnail = ImageOps.fit(image.convert('RGB'), current_app.config['PHOTO_THUMB_SIZE'], Image.Resampling.LANCZOS)
+    _write_atomically(target, lambda f: thumbnail.save(f, 'JPEG', quality=current_app.config['PHOTO_THUMB_QUALITY'], optimize=True))
+
+
+# delete the photos (and thumbnails) no item uses, returns how many files went
+# only files older than min_age seconds are deleted so an upload whose item
+# hasn't been committed yet is left alone
+def prune(min_age=3600):
+    used = set(db.session.scalars(db.select(Item.photo).where(Item.photo.is_not(None)).distinct()))
+    used_thumbnails = {name.split('.')[0] + '.jpg' for name in used}
+    root = _directory()
+    cutoff = time.time() - min_age
+    removed = 0
+    for directory, _, files in os.walk(root):
+        keep = used_thumbnails if os.path.relpath(directory, root).split(os.sep)[0] == 'thumbs' else used
+        for filename in files:
+            file_path = os.path.join(directory, filename)
+            if filename not in keep and os.path.getmtime(file_path) < cutoff:
+                os.unlink(file_path)
+                removed += 1
+    return removed
+
+
+# the thumbnail size for the img tags, so the page doesn't jump as they load
+@app.context_processor
+def thumbnail_size():
+    return {'thumb_size': current_app.config['PHOTO_THUMB_SIZE']}
@@ -0,0 +1,210 @@
+import os
+import threading
+from flask import current_app
+from whoosh import index
+from whoosh.analysis import StemmingAnalyzer
+from whoosh.fields import Schema, ID, TEXT
+from whoosh.qparser import MultifieldParser, OrGroup
+from whoosh.writing import AsyncWriter
+from app import jobs
+
+# full text search over items and inventories using whoosh indexes on disk
+# (Flask-WhooshAlchemy is pinned in requirements.txt but imports flask.ext
+# which was removed in flask 1.0, so whoosh is used directly)
+#
+# items and inventories are kept in separate indexes so a word from an inventory
+# title doesn't match (and have to rank) every item in that inventory, and renaming
+# an inventory only updates one document.
+# the indexes are kept up to date a few documents at a time by background jobs
+# (queued with queue_items() etc. in the same transaction as the change),
+# "flask search-reindex" rebuilds them from the database
+
+# names count for more than descriptions when ranking results
+ITEM_SCHEMA = Schema(
+    id=ID(stored=True, unique=True),
+    name=TEXT(analyzer=StemmingAnalyzer(), field_boost=3.0),
+    description=TEXT(analyzer=StemmingAnalyzer()),
+)
+
+INVENTORY_SCHEMA = Schema(
+    id=ID(stored=True, unique=True),
+    title=TEXT(analyzer=StemmingAnalyzer(), field_boost=3.0),
+    description=TEXT(analyzer=StemmingAnalyzer()),
+)
+
+SCHEMAS = {"items": ITEM_SCHEMA, "inventories": INVENTORY_SCHEMA}
+
+_indexes = {}
+_index_lock = threading.Lock()
+# searchers are kept per thread and refreshed when the index changes,
+# opening a new one for every query would re-read the segment files each time
+_local = threading.local()
+
+
+def get_index(name):
+    if name not in _indexes:
+        with _index_lock:
+            if name not in _indexes:
+                directory = current_app.config["SEARCH_INDEX_DIR"]
+                if index.exists_in(directory, indexname=name):
+                    _indexes[name] = index.open_dir(directory, indexname=name)
+                else:
+                    os.makedirs(directory, exist_ok=True)
+                    _indexes[name] = index.create_in(directory, SCHEMAS[name], indexname=name)
+    return _indexes[name]
+
+
+def _item_document(item):
+    return {"id": str(item.id), "name": item.name, "description": item.description or ""}
+
+
+def _inventory_document(inventory):
+    return {"id": str(inventory.id), "title": inventory.title, "description": inventory.description or ""}
+
+
+def _update(name, documents):
+    writer = None
+    for document in documents:
+        if writer is None:
+            # AsyncWriter waits for the write lock in the background if another worker holds it
+            writer = AsyncWriter(get_index(name))
+        writer.update_document(**document)
+    if writer is not None:
+        writer.commit()
+
+
+def _remove(name, ids):
+    ids = list(ids)
+    if not ids:
+        return
+    writer = AsyncWriter(get_index(name))
+    for id in ids:
+        writer.delete_by_term("id", str(id))
+    writer.commit()
+
+
+# add or update the given items in the index
+def index_items(items):
+    _update("items", (_item_document(item) for item in items))
+
+
+# remove the items with the given ids from the index
+def remove_items(item_ids):
+    _remove("items", item_ids)
+
+
+# add or update the items in an inventory with ids between first_id and last_id
+# (used after a bulk import, the items are read back in batches)
+def index_inventory_items(inventory_id, first_id, last_id):
+    from app import db
+    from app.models import Item
+
+    rows = db.session.execute(
+        db.select(Item.id, Item.name, Item.description)
+        .where(Item.inventory_id == inventory_id, Item.id.between(first_id, last_id))
+        .execution_options(yield_per=1000)
+    )
+    _update("items", (_item_document(row) for row in rows))
+
+
+# add or update the given inventories in the index
+def index_inventories(inventories):
+    _update("inventories", (_inventory_document(inventory) for inventory in inventories))
+
+
+# jobs that bring the index up to date with the database
+
+# the given items as they are now: updated if they still exist, removed if not
+@jobs.handler("search.refresh_items")
+def refresh_items(item_ids):
+    from app import db
+    from app.models import Item
+
+    rows = db.session.execute(db.select(Item.id, Item.name, Item.description).where(Item.id.in_(item_ids))).all()
+    index_items(rows)
+    remove_items(set(item_ids) - {row.id for row in rows})
+
+
+@jobs.handler("search.refresh_inventories")
+def refresh_inventories(inventory_ids):
+    from app import db
+    from app.models import Inventory
+
+    rows = db.session.execute(
+        db.select(Inventory.id, Inventory.title, Inventory.description).where(Inventory.id.in_(inventory_ids))
+    ).all()
+    index_inventories(rows)
+    _remove("inventories", set(inventory_ids) - {row.id for row in rows})
+
+
+jobs.handler("search.index_inventory_items")(index_inventory_items)
+
+
+def queue_items(item_ids):
+    if item_ids:
+        jobs.enqueue("search.refresh_items", item_ids=sorted(set(item_ids)))
+
+
+def queue_inventories(inventory_ids):
+    if inventory_ids:
+        jobs.enqueue("search.refresh_inventories", inventory_ids=sorted(set(inventory_ids)))
+
+
+def queue_inventory_items(inventory_id, first_id, last_id):
+    jobs.enqueue("search.index_inventory_items", inventory_id=inventory_id, first_id=first_id, last_id=last_id)
+
+
+# rebuild both indexes from the database
+# rows are read in batches so this works the same for 100 or 100k items
+def rebuild_index():
+    from app import db
+    from app.models import Item, Inventory
+
+    directory = current_app.config["SEARCH_INDEX_DIR"]
+    os.makedirs(directory, exist_ok=True)
+
+    counts = {}
+    for name, model, document in (
+        ("items", Item, _item_document),
+        ("inventories", Inventory, _inventory_document),
+    ):
+        with _index_lock:
+            _indexes[name] = index.create_in(directory, SCHEMAS[name], indexname=name)
+        writer = _indexes[name].writer(limitmb=128)
+        counts[name] = 0
+        for row in db.session.scalars(db.select(model).execution_options(yield_per=1000)):
+            writer.add_document(**document(row))
+            counts[name] += 1
+        writer.commit(optimize=True)
+    return counts
+
+
+def _searcher(name):
+    searchers = getattr(_local, "searchers", None)
+    if searchers is None:
+        searchers = _local.searchers = {}
+    searcher = searchers.get(name)
+    if searcher is None:
+        searcher = get_index(name).searcher()
+    else:
+        # returns the same searcher if nothing has been written since
+        searcher = searcher.refresh()
+    searchers[name] = searcher
+    return searcher
+
+
+def _search(name, fields, query_string, page, per_page):
+    parser = MultifieldParser(fields, schema=SCHEMAS[name], group=OrGroup.factory(0.9))
+    results = _searcher(name).search_page(parser.parse(query_string), page, pagelen=per_page)
+    return [int(hit["id"]) for hit in results], results.total
+
+
+# search item names and descriptions, returns the ids of the matching items
+# on the given page (best match first) and the total number of matches
+def search_items(query_string, page=1, per_page=30):
+    return _search("items", ["name", "description"], query_string, page, per_page)
+
+
+# search inventory titles and descriptions, same return value as search_items
+def search_inventories(query_string, page=1, per_page=5):
+    return _search("inventories", ["title", "description"], query_string, page, per_page)
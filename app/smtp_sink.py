@@ -0,0 +1,70 @@
+import os
+import socketserver
+import time
+import uuid
+
+# a stand-in smtp server for development and tests ("flask smtp-sink"), it takes
+# every message and saves it to a directory as an .eml file instead of delivering
+# it. it only speaks enough smtp for smtplib (no tls or auth).
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 smtp-sink ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                sender, recipients = command.partition(':')[2].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.partition(':')[2].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b'.\r\n', b'.\n'):
+                        break
+                    # undo the dot stuffing
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                self.server.save(sender, recipients, b''.join(lines))
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                if verb == 'RSET':
+                    sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # echo is called with a line about each message saved
+    def __init__(self, address, directory, echo=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.echo = echo
+        super().__init__(address, _Session)
+
+    def save(self, sender, recipients, message):
+        path = os.path.join(self.directory, '%d-%s.eml' % (time.time_ns(), uuid.uuid4().hex[:8]))
+        with open(path, 'wb') as f:
+            f.write(message)
+        if self.echo:
+            self.echo('%s -> %s saved to %s' % (sender, ', '.join(recipients), path))
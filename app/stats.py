@@ -0,0 +1,186 @@
+from collections import Counter, defaultdict
+from sqlalchemy import event, inspect
+from app import db
+from app.models import Inventory, Item, Loan, InventoryStats
+
+# per inventory counters (items by loan status and condition, total items and
+# pending loan requests) in the inventory_stats table
+#
+# they are changed by small "column = column + n" UPDATEs in the same transaction
+# as the change being counted:
+#   - item and loan changes made through the orm are picked up by the mapper
+#     events at the bottom of this file
+#   - code that changes rows with bulk statements (the importer, the api batch
+#     endpoints, app/loans.py) works out the deltas itself and applies them
+# "flask reconcile-counters" recomputes every row from the items and loans tables.
+
+LOAN_STATUSES = list(Item.loan_status.type.enums)
+CONDITIONS = list(Item.condition.type.enums)
+COUNTERS = ['total_items', 'pending_loans'] + LOAN_STATUSES + CONDITIONS
+
+_stats = InventoryStats.__table__
+
+# pending loans are counted against the inventory of the loan's item
+_adjust_pending = (
+    _stats.update()
+    .where(_stats.c.inventory_id == db.select(Item.inventory_id).where(Item.id == db.bindparam('item_id')).scalar_subquery())
+    .values(pending_loans=_stats.c.pending_loans + db.bindparam('delta'))
+)
+
+
+# changes to the counters collected per inventory, applied with one UPDATE per inventory
+class Deltas:
+    def __init__(self):
+        self.inventories = defaultdict(Counter)
+
+    # an item added (sign=1) or removed (sign=-1)
+    def item(self, inventory_id, loan_status, condition, sign=1):
+        counts = self.inventories[inventory_id]
+        counts['total_items'] += sign
+        counts[loan_status] += sign
+        counts[condition] += sign
+
+    # an item moving from one loan status to another
+    def loan_status(self, inventory_id, old, new):
+        self.inventories[inventory_id][old] -= 1
+        self.inventories[inventory_id][new] += 1
+
+    def pending_loans(self, inventory_id, delta):
+        self.inventories[inventory_id]['pending_loans'] += delta
+
+    def apply(self, connection=None):
+        connection = connection or db.session.connection()
+        for inventory_id, counts in self.inventories.items():
+            values = {name: _stats.c[name] + delta for name, delta in counts.items() if delta}
+            if values:
+                connection.execute(_stats.update().where(_stats.c.inventory_id == inventory_id).values(values))
+        self.inventories.clear()
+
+
+# change the pending loan count for the inventories of the given items
+# (item ids can repeat, one per loan)
+def pending_loans_changed(item_ids, delta, connection=None):
+    connection = connection or db.session.connection()
+    counts = Counter(item_ids)
+    if counts:
+        connection.execute(_adjust_pending, [{'item_id': item_id, 'delta': delta * n} for item_id, n in counts.items()])
+
+
+# the counters for one inventory as a dict (all zeros if there is no row)
+def get(inventory_id):
+    row = db.session.execute(db.select(*[_stats.c[name] for name in COUNTERS]).where(_stats.c.inventory_id == inventory_id)).first()
+    return dict(row._mapping) if row else dict.fromkeys(COUNTERS, 0)
+
+
+# work the counters out from scratch with GROUP BY queries
+# returns {inventory id: {counter: value}} for every inventory
+def compute(inventory_ids=None):
+    def only(query, column):
+        return query if inventory_ids is None else query.where(column.in_(inventory_ids))
+
+    counts = {
+        inventory_id: dict.fromkeys(COUNTERS, 0)
+        for inventory_id in db.session.scalars(only(db.select(Inventory.id), Inventory.id))
+    }
+    for column, values in ((Item.loan_status, LOAN_STATUSES), (Item.condition, CONDITIONS)):
+        rows = db.session.execute(
+            only(db.select(Item.inventory_id, column, db.func.count()).group_by(Item.inventory_id, column), Item.inventory_id)
+        )
+        for inventory_id, value, count in rows:
+            if inventory_id in counts:
+                counts[inventory_id][value] = count
+                if column is Item.loan_status:
+                    counts[inventory_id]['total_items'] += count
+    rows = db.session.execute(
+        only(
+            db.select(Item.inventory_id, db.func.count())
+            .join(Loan.item)
+            .where(Loan.status == 'pending')
+            .group_by(Item.inventory_id),
+            Item.inventory_id,
+        )
+    )
+    for inventory_id, count in rows:
+        if inventory_id in counts:
+            counts[inventory_id]['pending_loans'] = count
+    return counts
+
+
+# replace the stored counters with freshly computed ones (commits)
+# returns the ids of the inventories whose stored counters were wrong
+def reconcile(inventory_ids=None):
+    expected = compute(inventory_ids)
+    stored = {
+        row.inventory_id: {name: getattr(row, name) for name in COUNTERS}
+        for row in db.session.execute(
+            db.select(_stats).where(_stats.c.inventory_id.in_(expected)) if inventory_ids is not None else db.select(_stats)
+        )
+    }
+    wrong = sorted(inventory_id for inventory_id in set(expected) | set(stored) if expected.get(inventory_id) != stored.get(inventory_id))
+    if wrong:
+        db.session.execute(_stats.delete().where(_stats.c.inventory_id.in_(wrong)))
+        rows = [dict(counts, inventory_id=inventory_id) for inventory_id, counts in expected.items() if inventory_id in wrong]
+        if rows:
+            db.session.execute(_stats.insert(), rows)
+    db.session.commit()
+    return wrong
+
+
+# orm changes
+
+@event.listens_for(Inventory, 'after_insert')
+def _inventory_created(mapper, connection, target):
+    connection.execute(_stats.insert().values(inventory_id=target.id))
+
+
+@event.listens_for(Inventory, 'after_delete')
+def _inventory_deleted(mapper, connection, target):
+    connection.execute(_stats.delete().where(_stats.c.inventory_id == target.id))
+
+
+# the value an attribute had before this flush
+def _old_value(target, name):
+    history = inspect(target).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(target, name)
+
+
+@event.listens_for(Item, 'after_insert')
+def _item_created(mapper, connection, target):
+    deltas = Deltas()
+    deltas.item(target.inventory_id, target.loan_status, target.condition)
+    deltas.apply(connection)
+
+
+@event.listens_for(Item, 'after_update')
+def _item_updated(mapper, connection, target):
+    deltas = Deltas()
+    deltas.item(_old_value(target, 'inventory_id'), _old_value(target, 'loan_status'), _old_value(target, 'condition'), -1)
+    deltas.item(target.inventory_id, target.loan_status, target.condition)
+    # nothing is run if none of the counted fields changed
+    deltas.apply(connection)
+
+
+@event.listens_for(Item, 'after_delete')
+def _item_deleted(mapper, connection, target):
+    deltas = Deltas()
+    deltas.item(target.inventory_id, _old_value(target, 'loan_status'), _old_value(target, 'condition'), -1)
+    deltas.apply(connection)
+
+
+@event.listens_for(Loan, 'after_insert')
+def _loan_created(mapper, connection, target):
+    if target.status == 'pending':
+        pending_loans_changed([target.item_id], 1, connection)
+
+
+@event.listens_for(Loan, 'after_update')
+def _loan_updated(mapper, connection, target):
+    was_pending = _old_value(target, 'status') == 'pending'
+    if was_pending != (target.status == 'pending'):
+        pending_loans_changed([target.item_id], -1 if was_pending else 1, connection)
+
+
+@event.listens_for(Loan, 'after_delete')
+def _loan_deleted(mapper, connection, target):
+    if _old_value(target, 'status') == 'pending':
+        pending_loans_changed([target.item_id], -1, connection)
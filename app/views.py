@@ -1,10 +1,26 @@
-from flask import render_template, redirect, flash, url_for
+import os
+from flask import render_template, redirect, flash, url_for, request, abort, make_response, send_file, Response, stream_with_context
 from flask_login import login_user, login_required, logout_user, current_user
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
 from app import app, db
-from datetime import datetime
-from app.models import User, Inventory, Item, Loan
-from app.forms import LoginForm, SignupForm, CreateInventoryForm, CreateItemForm, DeleteItemButtonForm, LoanButtonForm, RejectButtonForm, ApproveButtonForm, EditItemButtonForm, ClearLoanButtonForm, CancelLoanButtonForm, ReturnLoanButtonForm
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.models import User, Inventory, Item, Loan, Notification
+from app.pagination import keyset_paginate, get_per_page, page_key
+from app import search, cache, importer, export, loans, stats, analytics, notifications, passwords, photos, conditional, item_cards
+from app.forms import LoginForm, SignupForm, CreateInventoryForm, CreateItemForm, ImportItemsForm, RejectButtonForm, ApproveButtonForm, ClearLoanButtonForm, CancelLoanButtonForm, ReturnLoanButtonForm, BulkLoanForm, MarkNotificationsReadForm
+
+
+# one page of an inventorys items, shared by my inventory and view inventory
+# only the columns the cards need are loaded and the page is cached until
+# something changes an item in the inventory. version is the pages validator
+# version of those items (app/conditional.py), so the cached page is always the
+# one the ETag was worked out for
+def cached_item_page(inventory_id, version):
+    return cache.cached(cache.inventory_namespace(inventory_id), 'items:%s:%s' % (version, page_key()), lambda: keyset_paginate(
+        db.session.query(Item.id, Item.version, Item.updated_at, Item.name, Item.description, Item.condition, Item.loan_status, Item.photo)
+        .filter(Item.inventory_id == inventory_id),
+        Item.id,
+    ))
 
 
 # index page for website
@@ -25,65 +41,47 @@ def home():
 @app.route('/my-inventory')
 @login_required
 def my_inventory():
-    
-    repair_status_badge = {
-        "functional": "success",
-        "minor_repair": "warning",
-        "under_repair": "info",
-        "out_of_service": "danger",
-        "missing_parts": "secondary",
-        "inspection_needed": "primary",
-    }
-
-    loan_status_badge = {
-        "available": "success",
-        "on_loan": "warning",
-        "unavailable": "secondary",
-    }
+    # answer 304 if nothing on the page changed since the browser last saw it
+    validator = conditional.Validator(conditional.owned_inventory(current_user.id), conditional.owned_loans(current_user.id))
+    if validator.fresh():
+        return validator.response()
 
     #get current users inventory 
     inventory = Inventory.query.filter_by(owner_id=current_user.id).first()
 
     # if inventory exists then
     if inventory:
-        # get all the items in that inventory
-        items = Item.query.filter_by(inventory_id=inventory.id).all()
-
-        # initilise empty list of cards
-        cards = []
-
-        # foreach item in the inventory
-        for item in items:
-            #set forms
-            edit_form = EditItemButtonForm()
-            delete_form = DeleteItemButtonForm()
-
-            #make a card that can be displayed 
-            card = {
-                "name": item.name,
-                "description": item.description,
-                # must make _ a space
-                "repair_status": item.condition.title().replace("_", " "),
-                "loan_status": item.loan_status.title().replace("_", " "),  
-                "repair_status_class": repair_status_badge.get(item.condition),
-                "loan_status_class": loan_status_badge.get(item.loan_status), 
-                # forms and links for the buttons and wtforms
-                "edit_form": edit_form,
-                "edit_link":  url_for('edit_item', item_id=item.id), 
-                "delete_form": delete_form, 
-                "delete_link": url_for('delete_item', item_id=item.id), 
-            }
+        # get one page of the items in that inventory
+        page = cached_item_page(inventory.id, validator.versions[0])
 
-            # adds card to list of cards 
-            cards.append(card)
+        # counts for the summary line, one row from inventory_stats
+        counters = stats.get(inventory.id)
 
-        return render_template('inventory/my-inventory.html', cards=cards, inventory=inventory, user_logged_in=current_user.is_authenticated)
+        # the cards are rendered from the page rows, or taken from the card cache (app/item_cards.py)
+        return validator.response(render_template('inventory/my-inventory.html', cards=item_cards.owner_cards(page), page=page, inventory=inventory,
+                                                  counters=counters, user_logged_in=current_user.is_authenticated))
     
     # if the user has no inventory direct them to make one
     else:
         return redirect(url_for('create_inventory'))
 
 
+# loan and repair figures for the current users inventory
+@app.route('/inventory-dashboard')
+@login_required
+def inventory_dashboard():
+    inventory = Inventory.query.filter_by(owner_id=current_user.id).first()
+    if inventory is None:
+        return redirect(url_for('create_inventory'))
+
+    dashboard = analytics.dashboard(inventory.id)
+
+    # the busiest month sets the width of the bars
+    busiest = max([month['requests'] for month in dashboard['per_month']] + [1])
+
+    return render_template('inventory/dashboard.html', inventory=inventory, dashboard=dashboard, busiest=busiest, user_logged_in=current_user.is_authenticated)
+
+
 # allow the user to create an inventory
 @app.route('/create-inventory', methods=['GET', 'POST'])
 @login_required
@@ -97,7 +95,10 @@ def create_inventory():
         new_inventory = Inventory(owner_id=current_user.id, title=form.title.data, description=form.description.data)
         #update database
         db.session.add(new_inventory)
+        db.session.flush()
+        search.queue_inventories([new_inventory.id])
         db.session.commit()
+        cache.invalidate(cache.INVENTORIES)
         # redirect user to there new inventory
         return redirect(url_for('my_inventory'))
     
@@ -118,6 +119,14 @@ def create_item():
 
     # if valid form is submitted
     if form.validate_on_submit():
+        # the photo (if any) is stored first, the item only refers to it by name
+        photo = None
+        try:
+            if form.photo_file.data:
+                photo = photos.save(form.photo_file.data)
+        except photos.PhotoError as e:
+            flash(str(e), 'danger')
+            return render_template('item/create-item.html', form=form, inventory_id=inventory.id, user_logged_in=current_user.is_authenticated)
         
         # create a new item with the form data
         new_item = Item(
@@ -125,17 +134,102 @@ def create_item():
             name=form.name.data,
             description=form.description.data,
             loan_status=form.loan_status.data,
-            condition=form.condition.data
+            condition=form.condition.data,
+            photo=photo
         )
         # add and save item to the database
         db.session.add(new_item)
+        db.session.flush()
+        search.queue_items([new_item.id])
+        if photo:
+            photos.queue_thumbnail(photo)
         db.session.commit()
+        cache.invalidate(cache.inventory_namespace(inventory.id))
         flash('Item created successfully!', 'success')
         # return the user to there inventory
         return redirect(url_for('my_inventory'))
     
     return render_template('item/create-item.html', form=form, inventory_id=inventory.id, user_logged_in=current_user.is_authenticated)
 
+# allow the user to add many items to there inventory at once from a csv or json file
+@app.route('/import-items', methods=['GET', 'POST'])
+@login_required
+def import_items():
+    inventory = Inventory.query.filter_by(owner_id=current_user.id).first()
+
+    # if the current user doesnt have an inventory redirect them to make one
+    if not inventory:
+        flash("Inventory not found.", "danger")
+        return redirect(url_for('my_inventory'))
+
+    form = ImportItemsForm()
+    result = None
+
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            rows = importer.iter_rows(upload.stream, upload.filename)
+        except importer.ImportFormatError as e:
+            flash(str(e), 'danger')
+        else:
+            # rows are read from the upload and inserted a batch at a time
+            result = importer.import_items(inventory.id, rows)
+            if result.imported:
+                flash('Imported %d items.' % result.imported, 'success')
+            if result.error_count or result.format_error:
+                flash('Some rows could not be imported, see below.', 'warning')
+
+    return render_template('item/import-items.html', form=form, result=result,
+                           loan_statuses=sorted(importer.LOAN_STATUSES), conditions=sorted(importer.CONDITIONS),
+                           user_logged_in=current_user.is_authenticated)
+
+# send rows as a csv or xlsx download, written out while the rows are still being read
+def export_response(fmt, filename, header, rows, sheet_name):
+    body = export.stream_table(fmt, header, rows, sheet_name)
+    response = Response(stream_with_context(body), mimetype=export.FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, fmt)
+    return response
+
+# download the items in the users inventory as a csv or xlsx file
+@app.route('/export-items.<fmt>')
+@login_required
+def export_items(fmt):
+    if fmt not in export.FORMATS:
+        abort(404)
+
+    inventory = Inventory.query.filter_by(owner_id=current_user.id).first()
+    if not inventory:
+        flash("Inventory not found.", "danger")
+        return redirect(url_for('my_inventory'))
+
+    # yield_per fetches the rows a batch at a time (a server side cursor on postgres)
+    rows = db.session.execute(
+        db.select(Item.id, Item.name, Item.description, Item.condition, Item.loan_status)
+        .where(Item.inventory_id == inventory.id)
+        .order_by(Item.id)
+        .execution_options(yield_per=1000)
+    )
+    header = ['ID', 'Name', 'Description', 'Condition', 'Loan Status']
+    return export_response(fmt, 'items', header, rows, inventory.title)
+
+# download every loan request made for the users items as a csv or xlsx file
+@app.route('/export-loans.<fmt>')
+@login_required
+def export_loans(fmt):
+    if fmt not in export.FORMATS:
+        abort(404)
+
+    rows = db.session.execute(
+        db.select(Loan.id, Item.id, Item.name, User.username, User.email, Loan.status, Loan.request_date)
+        .join(Loan.item)
+        .join(Loan.borrower)
+        .where(Loan.owner_id == current_user.id)
+        .order_by(Loan.id)
+        .execution_options(yield_per=1000)
+    )
+    header = ['Loan ID', 'Item ID', 'Item', 'Borrower', 'Borrower Email', 'Status', 'Requested']
+    return export_response(fmt, 'loan-history', header, rows, 'Loan History')
+
 # allows the user to edit a given item (must own item to edit it)
 @app.route('/edit/<int:item_id>',  methods=['GET', 'POST'])
 @login_required
@@ -145,7 +239,6 @@ def edit_item(item_id):
 
     # get the user who owns the item 
     inventory = Inventory.query.filter_by(id=item.inventory_id).first()    
-    user = User.query.filter_by(id=item.inventory_id).first()
 
     # if the user doesnt own the current item 
     if inventory.owner_id != current_user.id:
@@ -156,19 +249,71 @@ def edit_item(item_id):
     # initlise item form with selected items information 
     form = CreateItemForm(obj=item)
     if form.validate_on_submit():
+        # the photo (if any) is stored first, the item only refers to it by name
+        photo = None
+        try:
+            if form.photo_file.data:
+                photo = photos.save(form.photo_file.data)
+        except photos.PhotoError as e:
+            flash(str(e), 'danger')
+            return render_template('item/edit-item.html', form=form, item=item, user_logged_in=current_user.is_authenticated)
+
         #update item infomation 
         item.name=form.name.data
         item.description=form.description.data
         item.loan_status=form.loan_status.data
         item.condition=form.condition.data
+        if photo:
+            item.photo = photo
+            photos.queue_thumbnail(photo)
+        elif form.remove_photo.data:
+            item.photo = None
         
         #save to db and output success
-        db.session.commit()
+        search.queue_items([item.id])
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # the item was lent out or returned since it was loaded (its version
+            # moved on), saving the form now would undo that
+            db.session.rollback()
+            flash('Item changed while you were editing it, please try again.', 'warning')
+            return redirect(url_for('edit_item', item_id=item_id))
+        cache.invalidate(cache.inventory_namespace(item.inventory_id))
         flash('Item edited successfully!', 'success')
         #return user to there inventory
         return redirect(url_for('my_inventory'))
     return render_template('item/edit-item.html', form=form, item=item, user_logged_in=current_user.is_authenticated)
 
+# item photos and their thumbnails. the names are content hashes so a url
+# always means the same picture and can be cached for good, send_file answers
+# If-None-Match with a 304 and serves Range requests
+PHOTO_MAX_AGE = 365 * 24 * 60 * 60
+
+def send_photo(path, name):
+    try:
+        response = send_file(path, conditional=True, etag=name, max_age=PHOTO_MAX_AGE)
+    except FileNotFoundError:
+        abort(404)
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/photos/<name>')
+def item_photo(name):
+    if not photos.valid_name(name):
+        abort(404)
+    return send_photo(photos.path(name), name)
+
+@app.route('/photos/thumbs/<name>')
+def item_thumbnail(name):
+    if not photos.valid_name(name):
+        abort(404)
+    path = photos.thumbnail_path(name)
+    if not os.path.exists(path):
+        # the job queued with the upload hasn't made it yet (redirects aren't cached)
+        return redirect(url_for('item_photo', name=name))
+    return send_photo(path, name)
+
 # non visable route to delete items   
 @app.route('/delete/<int:item_id>', methods=['POST'])
 @login_required
@@ -179,7 +324,6 @@ def delete_item(item_id):
 
     # get the user who owns the item 
     inventory = Inventory.query.filter_by(id=item.inventory_id).first()
-    user = User.query.filter_by(id=item.inventory_id).first()
 
     # if the user doesnt own the current item output error and redirect
     if inventory.owner_id != current_user.id:
@@ -188,7 +332,15 @@ def delete_item(item_id):
 
     # delete item and update db
     db.session.delete(item)
-    db.session.commit()
+    search.queue_items([item_id])
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # lent out or returned since it was loaded, let the owner look again
+        db.session.rollback()
+        flash('Item changed, please try again.', 'warning')
+        return redirect(url_for('my_inventory'))
+    cache.invalidate(cache.inventory_namespace(inventory.id))
     flash('Item deleted', 'success')
     return redirect(url_for('my_inventory'))
 
@@ -213,7 +365,9 @@ def manage_inventory():
         inventory.description = form.description.data
 
         #update db with new data
+        search.queue_inventories([inventory.id])
         db.session.commit()
+        cache.invalidate(cache.INVENTORIES)
         flash("Inventory updated successfully!", "success")
         return redirect(url_for('my_inventory'))
 
@@ -223,11 +377,17 @@ def manage_inventory():
 @app.route('/all-inventories', methods=['GET', 'POST'])
 def all_inventories():
 
-    #get all inventoreis 
-    inventories = Inventory.query.all()
+    validator = conditional.Validator(conditional.inventories(), csrf=False)
+    if validator.fresh():
+        return validator.response()
+
+    #get one page of inventoreis (cached until an inventory is created or changed)
+    page = cache.cached(cache.INVENTORIES, 'page:%s:%s' % (validator.versions[0], page_key()), lambda: keyset_paginate(
+        db.session.query(Inventory.id, Inventory.title, Inventory.description), Inventory.id,
+    ))
     cards = []
     
-    for inventory in inventories:
+    for inventory in page:
         # make card of each inventory
         card = {
             "title": inventory.title,
@@ -238,72 +398,97 @@ def all_inventories():
         cards.append(card)
     
     # display cards
-    return render_template('inventory/all-inventories.html', cards=cards, user_logged_in=current_user.is_authenticated)
+    return validator.response(render_template('inventory/all-inventories.html', cards=cards, page=page, user_logged_in=current_user.is_authenticated))
 
 # display an inventory with the given inventory id 
 @app.route('/view-inventory/<int:inventory_id>', methods=['GET', 'POST'])
 def view_inventory(inventory_id):
+    # the inventory, its items and the users loans of them decide what the page shows
+    sources = [conditional.inventory(inventory_id)]
+    if current_user.is_authenticated:
+        sources.append(conditional.borrowed_from(inventory_id, current_user.id))
+    validator = conditional.Validator(*sources)
+    if validator.fresh():
+        return validator.response()
+
     # get inventory 
     inventory = Inventory.query.get_or_404(inventory_id)
 
-    repair_status_badge = {
-        "functional": "success",
-        "minor_repair": "warning",
-        "under_repair": "info",
-        "out_of_service": "danger",
-        "missing_parts": "secondary",
-        "inspection_needed": "primary",
-    }
-
-    loan_status_badge = {
-        "available": "success",
-        "on_loan": "warning",
-        "requested": "warning",
-        "unavailable": "secondary",
-    }
-
     # check if user is signed in for the loan system
     if not current_user.is_authenticated:
         flash("you must be signed in to loan items")
 
     # if there is an inventory to display then
     if inventory:
-        # get items in the inventory
-        items = Item.query.filter_by(inventory_id=inventory.id).all()
-        cards = []
-        # for each item in the inventory 
-        for item in items:
-            # check if the user can request the item
-            item_loan_status = item.loan_status
-            can_loan = "False"
-            if current_user.is_authenticated:
-                if item.loan_status == 'available':
-                    current_user_loans = Loan.query.filter_by(borrower_id=current_user.id, item_id=item.id).first()
-                    if current_user_loans:
-                        item_loan_status = 'requested'
-                    else:
-                        can_loan = "True"
-
-            
-            # make item into a card
-            loan_form = LoanButtonForm()
+        # get one page of items in the inventory
+        page = cached_item_page(inventory.id, validator.versions[0])
+
+        # get the ids of every item on this page the user already has an open loan on
+        # (one query for the whole page instead of one per item), the same check
+        # loans.request_loan makes
+        requested_item_ids = set()
+        if current_user.is_authenticated and page.items:
+            requested_item_ids = {
+                item_id for (item_id,) in db.session.query(Loan.item_id)
+                .filter(Loan.borrower_id == current_user.id, Loan.item_id.in_([item.id for item in page]),
+                        Loan.status.in_(loans.OPEN_STATUSES))
+            }
+
+        return validator.response(render_template('inventory/view-inventory.html', cards=item_cards.borrower_cards(page, requested_item_ids),
+                                                  page=page, inventory=inventory, user_logged_in=current_user.is_authenticated))
+    else:
+        flash("Error: could not find inventory", "warning")
+        return redirect(url_for('all_inventories'))
+
+# search every inventory for items by name, description or inventory title
+@app.route('/search')
+def search_items():
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = get_per_page()
+
+    cards = []
+    inventory_cards = []
+    total = 0
+    if query:
+        # inventories whose title matches are shown above the items (first page only)
+        if page == 1:
+            inventory_ids, _ = search.search_inventories(query)
+            inventories = Inventory.query.filter(Inventory.id.in_(inventory_ids)).all()
+            inventories_by_id = {inventory.id: inventory for inventory in inventories}
+            for inventory_id in inventory_ids:
+                inventory = inventories_by_id.get(inventory_id)
+                if inventory:
+                    inventory_cards.append({
+                        "title": inventory.title,
+                        "description": inventory.description,
+                        "link": url_for('view_inventory', inventory_id=inventory.id),
+                    })
+
+        # get the ids of the best matching items from the search index
+        item_ids, total = search.search_items(query, page=page, per_page=per_page)
+
+        # load those items (and there inventories) in one query and keep the search order
+        items = Item.query.options(joinedload(Item.inventory)).filter(Item.id.in_(item_ids)).all()
+        items_by_id = {item.id: item for item in items}
+
+        for item_id in item_ids:
+            item = items_by_id.get(item_id)
+            # skip anything deleted since it was indexed
+            if not item:
+                continue
             card = {
                 "name": item.name,
                 "description": item.description,
+                "inventory_title": item.inventory.title,
                 "repair_status": item.condition.title().replace("_", " "),
-                "repair_status_class": repair_status_badge.get(item.condition),
-                "loan_status": item_loan_status.title().replace("_", " "),  
-                "loan_status_class": loan_status_badge.get(item_loan_status), 
-                "loan_form": loan_form,
-                "loan_link":  url_for('loan_request', item_id=item.id), 
-                "can_loan": can_loan
+                "loan_status": item.loan_status.title().replace("_", " "),
+                "link": url_for('view_inventory', inventory_id=item.inventory_id),
             }
-            cards.append(card)                    
+            cards.append(card)
 
-        return render_template('inventory/view-inventory.html', cards=cards, inventory=inventory, user_logged_in=current_user.is_authenticated)
-    else:
-        flash("Error: could not find inventory", "warning")
-        return redirect(url_for('all_inventories'))
+    has_next = page * per_page < total
+    return render_template('item/search.html', cards=cards, inventory_cards=inventory_cards, query=query, total=total, page=page, per_page=per_page, has_next=has_next, user_logged_in=current_user.is_authenticated)
 
 # non visable route to request a loan on a given item
 @app.route('/loan-request/<int:item_id>', methods=['GET', 'POST'])
@@ -312,31 +497,11 @@ def loan_request(item_id):
     # get item or error
     item = Item.query.get_or_404(item_id)
 
-    # if item doesnt exist and error failed
-    if not item:
-        flash('item not found.', 'error')
-        return redirect(url_for('all_inventories')) 
-    
-    # if the item is not available to loan 
-    if item.loan_status != 'available':
+    # the availability check and the insert happen in one statement so a
+    # request can't slip in as the item is being lent out
+    if not loans.request_loan(current_user.id, item_id):
         flash('item not avaliable for loan.', 'error')
-        return redirect(url_for('view_inventory', inventory_id=item.inventory_id)) 
-    
-    # get inventory owner
-    user_id = Inventory.query.filter_by(id=item.inventory_id).first().owner_id
-    
-    # create loan
-    loan = Loan(
-        item_id=item_id,
-        borrower_id=current_user.id,
-        owner_id=user_id,
-        status='pending',
-        request_date=datetime.utcnow()
-    )
-
-    # add loan to db
-    db.session.add(loan)
-    db.session.commit()
+        return redirect(url_for('view_inventory', inventory_id=item.inventory_id))
 
     flash('Loan request submitted successfully.', 'success')
     return redirect(url_for('view_inventory', inventory_id=item.inventory_id))
@@ -353,32 +518,37 @@ def manage_loans():
         "returned": "info",
     }
 
-    # get loans
-    loans = Loan.query.filter_by(owner_id=current_user.id).all()
+    # get loans along with the requested item and the borrower in the same query
+    rows = (
+        Loan.query.filter_by(owner_id=current_user.id)
+        .options(joinedload(Loan.item), joinedload(Loan.borrower))
+        .all()
+    )
 
     # output something to help the manager if theres no loans
-    if len(loans) == 0:
+    if len(rows) == 0:
         flash("you have no loan requests right right now!")
     
     
     cards = []
     reject_form = RejectButtonForm()
     approve_form = ApproveButtonForm()
+    bulk_form = BulkLoanForm()
 
-    # for each loan in loans
-    for loan in loans:
+    # for each loan in rows
+    for loan in rows:
         # get the item being reqested
-        item = Item.query.get(loan.item_id)
+        item = loan.item
 
         # if the item exists 
         if item:
             # make card
-            # get the name of the person requesting the loan
-            borrower_name = User.query.get_or_404(loan.borrower_id).username
             card = {
+                "loan_id": loan.id,
+                "pending": loan.status == 'pending',
                 "item_name": item.name,
                 "item_description": item.description,
-                "borrower_name": borrower_name,
+                "borrower_name": loan.borrower.username,
                 "request_status": item.loan_status,
                 "request_date": loan.request_date,
                 "approve_form": approve_form,
@@ -391,7 +561,7 @@ def manage_loans():
 
             cards.append(card)
     
-    return render_template('loans/manage-loans.html', cards=cards, user_logged_in=current_user.is_authenticated)
+    return render_template('loans/manage-loans.html', cards=cards, bulk_form=bulk_form, user_logged_in=current_user.is_authenticated)
 
 
 # route to for users to view there loans and loan request status
@@ -406,18 +576,22 @@ def view_loan_requests():
         "returned": "info",
     }
 
-    # get users loans
-    loans = Loan.query.filter_by(borrower_id=current_user.id).all()
+    # get users loans along with each item and the inventory it belongs to
+    rows = (
+        Loan.query.filter_by(borrower_id=current_user.id)
+        .options(joinedload(Loan.item).joinedload(Item.inventory))
+        .all()
+    )
 
     # output something to help the user if theres no loans
-    if len(loans) == 0:
+    if len(rows) == 0:
         flash("you have no loans right now!")
     
     
     cards = []
 
-    # for each loan in loans make a card to display info
-    for loan in loans:
+    # for each loan in rows make a card to display info
+    for loan in rows:
         link = None
         loan_form = None
         if (loan.status == 'pending'):
@@ -430,14 +604,13 @@ def view_loan_requests():
             link = url_for('clear_loan_request', loan_id=loan.id)
             loan_form = ClearLoanButtonForm()
 
-        item = Item.query.get(loan.item_id)
+        item = loan.item
 
         if item:
-            inventory = Inventory.query.get(item.inventory_id)
             card = {
                 "item_name": item.name,
                 "item_description": item.description,
-                "inventory_name": inventory.title,
+                "inventory_name": item.inventory.title,
                 "request_status": item.loan_status,
                 "request_date": loan.request_date,
                 "loan_form": loan_form,
@@ -454,17 +627,11 @@ def view_loan_requests():
 @app.route('/cancel-loan-request/<int:loan_id>', methods=['POST'])
 @login_required
 def cancel_loan_request(loan_id):
-    # get loan
-    loan = Loan.query.get_or_404(loan_id)
-
-    # if its not the current user or the item owner 
-    if loan.borrower_id != current_user.id and loan.owner_id != current_user.id:
+    # only pending requests can be cancelled (an approved one has to be returned)
+    if not loans.remove_loan(current_user.id, loan_id, ['pending']):
         flash("Error")
         return redirect(url_for('view_loan_requests'))
 
-    # delete loan
-    db.session.delete(loan)
-    db.session.commit()
     flash('Loan cancelled', 'success')
     return redirect(url_for('view_loan_requests'))
 
@@ -472,17 +639,10 @@ def cancel_loan_request(loan_id):
 @app.route('/clear-loan-request/<int:loan_id>', methods=['POST'])
 @login_required
 def clear_loan_request(loan_id):
-    # get loan
-    loan = Loan.query.get_or_404(loan_id)
-    
-    # if its not the current user or the item owner 
-    if loan.borrower_id != current_user.id and loan.owner_id != current_user.id:
+    if not loans.remove_loan(current_user.id, loan_id, ['rejected', 'returned']):
         flash("Error")
         return redirect(url_for('view_loan_requests'))
 
-    # delete loan
-    db.session.delete(loan)
-    db.session.commit()
     flash('Loan Cleared', 'success')
     return redirect(url_for('view_loan_requests'))
 
@@ -491,81 +651,102 @@ def clear_loan_request(loan_id):
 @app.route('/return-loan-request/<int:loan_id>', methods=['POST'])
 @login_required
 def return_loan_request(loan_id):
-    # get loan 
-    loan = Loan.query.get_or_404(loan_id)
-
-    # get item
-    item = Item.query.get_or_404(loan.item_id)
-    
-    # if its not the current user or the item owner     
-    if loan.borrower_id != current_user.id and loan.owner_id != current_user.id:
+    # marks the loan returned and makes the item available again, if it is an approved
+    # loan the current user is the borrower or owner of
+    if not loans.return_loan(current_user.id, loan_id):
         flash("Error")
         return redirect(url_for('view_loan_requests'))
-    
-    # set item ststus back to available to loan
-    item.loan_status = 'available'
-
-    # delete loan
-    db.session.delete(loan)
 
-    db.session.commit()
     flash('Loan Returned', 'success')
     return redirect(url_for('view_loan_requests'))
 
+# flash what happened to a set of loan decisions
+def flash_loan_decisions(decisions):
+    if decisions.approved:
+        flash('Loans approved: %d' % len(decisions.approved), 'success')
+    if decisions.rejected:
+        flash('Loans rejected: %d' % len(decisions.rejected), 'success')
+    if decisions.auto_rejected:
+        flash('Other requests for the same items rejected: %d' % len(decisions.auto_rejected), 'info')
+    if decisions.skipped:
+        flash("Loans not changed (not pending requests for your available items): %d" % len(decisions.skipped), 'warning')
+
 # non visable route to approve a loan with the given id
 @app.route('/approve-loan-request/<int:loan_id>', methods=['POST'])
 @login_required
 def approve_loan(loan_id):
-    # get loan
-    loan = Loan.query.get_or_404(loan_id)
-    # get item
-    item = Item.query.get_or_404(loan.item_id)
-    
-    # if its not the owner of the itme
-    if  loan.owner_id != current_user.id:
-        flash("Error you cant manage loans you dont own!")
-        return redirect(url_for('manage_loans'))
-
-    # if the item is not available to loan
-    if loan.loan_status == 'on_loan' or loan.loan_status == 'unavailable':
-        flash("Error you cant loan an unavilable item!")
-        return redirect(url_for('manage_loans'))
-
-    
-    # update loan status
-    item.loan_status = 'on_loan'
-    loan.status = 'approved'
-
-    db.session.commit()
-
-    flash('Loan approved', 'success')
+    # only pending requests for the current users available items are approved
+    flash_loan_decisions(loans.decide(current_user.id, approve=[loan_id]))
     return redirect(url_for('manage_loans'))
 
 # non visable route to reject a loan with the given id
 @app.route('/reject-loan-request/<int:loan_id>', methods=['POST'])
 @login_required
 def reject_loan(loan_id):
-    loan = Loan.query.get_or_404(loan_id)
-    
-    # if its not the owner of the item
-    if  loan.owner_id != current_user.id:
-        flash("Error")
-        return redirect(url_for('manage_loans'))
-
-    # update db
-    loan.status = 'rejected'
+    flash_loan_decisions(loans.decide(current_user.id, reject=[loan_id]))
+    return redirect(url_for('manage_loans'))
 
-    db.session.commit()
-    flash('Loan rejected', 'success')
+# approve or reject every loan ticked on the manage loans page in one transaction
+@app.route('/bulk-loan-requests', methods=['POST'])
+@login_required
+def bulk_loans():
+    form = BulkLoanForm()
+    loan_ids = request.form.getlist('loan_ids', type=int)
+
+    if not form.validate_on_submit() or not loan_ids:
+        flash("Select some loan requests first.", "warning")
+    elif form.approve.data:
+        flash_loan_decisions(loans.decide(current_user.id, approve=loan_ids))
+    else:
+        flash_loan_decisions(loans.decide(current_user.id, reject=loan_ids))
     return redirect(url_for('manage_loans'))
 
 
+# the current users notifications, newest first
+@app.route('/notifications')
+@login_required
+def view_notifications():
+    page = keyset_paginate(
+        db.session.query(Notification.id, Notification.message, Notification.link, Notification.is_read, Notification.created_at)
+        .filter(Notification.user_id == current_user.id),
+        Notification.id,
+        descending=True,
+    )
+    if len(page) == 0:
+        flash("you have no notifications right now!")
+
+    return render_template('notifications.html', page=page, form=MarkNotificationsReadForm(), user_logged_in=current_user.is_authenticated)
+
+# mark the ticked notifications (or all of them) read in one update
+@app.route('/mark-notifications-read', methods=['POST'])
+@login_required
+def mark_notifications_read():
+    form = MarkNotificationsReadForm()
+    notification_ids = request.form.getlist('notification_ids', type=int)
+
+    if not form.validate_on_submit():
+        flash("Error")
+    elif form.all.data:
+        notifications.mark_read(current_user.id)
+    elif notification_ids:
+        notifications.mark_read(current_user.id, notification_ids)
+    else:
+        flash("Select some notifications first.", "warning")
+    return redirect(url_for('view_notifications'))
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        if user and check_password_hash(user.password, form.password.data):
+        try:
+            # turn floods away before doing any hashing
+            passwords.admit(request.remote_addr, form.email.data)
+            user = User.query.filter_by(email=form.email.data).first()
+            valid = passwords.check_login(user, form.password.data)
+        except passwords.Busy as busy:
+            return too_busy(busy, 'authentication/login.html', form)
+        if valid:
             login_user(user, remember=True)
             return redirect(url_for('home'))
         else:
@@ -573,11 +754,23 @@ def login():
     return render_template('authentication/login.html', title='Home', user_logged_in=current_user.is_authenticated, form=form)
 
 
+# the form again with a 429 when login/signup attempts are being turned away
+def too_busy(busy, template, form):
+    flash('Too many attempts, please try again in a moment.')
+    response = make_response(render_template(template, title='Home', user_logged_in=current_user.is_authenticated, form=form), 429)
+    response.headers['Retry-After'] = str(busy.retry_after)
+    return response
+
+
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
     form = SignupForm()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data, method='pbkdf2:sha256')
+        try:
+            passwords.admit(request.remote_addr)
+            hashed_password = passwords.hash_password(form.password.data)
+        except passwords.Busy as busy:
+            return too_busy(busy, 'authentication/signup.html', form)
         new_user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(new_user)
         db.session.commit()
@@ -0,0 +1,23 @@
+# performance benchmarks for the inventory manager
+#
+#   python -m benchmarks                      run every route at the default scales
+#   python -m benchmarks.compare old new      diff two result files
+#
+# benchmarks run against a throwaway sqlite database, so the environment is pointed
+# at it here, before anything imports the app (and with it config.py).
+# set DATABASE_URL yourself to benchmark against another database instead.
+
+import atexit
+import os
+import shutil
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix='inventory-bench-')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db'))
+os.environ.setdefault('SEARCH_INDEX_DIR', os.path.join(WORK_DIR, 'search-index'))
+os.environ.setdefault('PHOTO_DIR', os.path.join(WORK_DIR, 'photos'))
+# every benchmark client logs in from 127.0.0.1, far more often than a person would
+os.environ.setdefault('LOGIN_IP_LIMIT', '0')
+os.environ.setdefault('LOGIN_ACCOUNT_LIMIT', '0')
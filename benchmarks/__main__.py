@@ -0,0 +1,65 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+import benchmarks  # points the app at the throwaway database before it is imported
+from benchmarks.datagen import SCALES
+from benchmarks.routes import run
+
+# python -m benchmarks [--scales small,medium] [--iterations 30] [--routes home,my_inventory] [--output results.json]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark every route at several data scales.')
+    parser.add_argument('--scales', default='small,medium', help='comma separated, any of: %s' % ', '.join(SCALES))
+    parser.add_argument('--iterations', type=int, default=30, help='timed requests per route')
+    parser.add_argument('--routes', default=None, help='comma separated route names to run (default all)')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    args = parser.parse_args(argv)
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error('unknown scale %r' % scale)
+    only = set(args.routes.split(',')) if args.routes else None
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'date': datetime.utcnow().isoformat(timespec='seconds'),
+            'iterations': args.iterations,
+        },
+        'scales': {},
+    }
+
+    for scale in scales:
+        print('== %s' % scale, file=sys.stderr)
+
+        def progress(name, result):
+            print('  %-24s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  sql %4d  peak %8.1fkB  [%d]' % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['sql_statements'], result['peak_memory_kb'], result['status']), file=sys.stderr)
+
+        results['scales'][scale] = run(scale, args.iterations, only=only, progress=progress)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from flask import before_render_template, template_rendered
+from sqlalchemy import insert
+
+import benchmarks
+from app import app, db, stats, cache
+from app.models import User, Inventory, Item, Loan
+from benchmarks.datagen import PASSWORD, _item_row
+from benchmarks.routes import _client, percentile
+from werkzeug.security import generate_password_hash
+
+# python -m benchmarks.card_render [--items 5000] [--iterations 20] [--output results.json]
+#
+# times the item card pages for one big inventory shown on a single page, as
+# the owner (my inventory) and as a borrower with loans on some of the items
+# (view inventory), and my inventory again with one item changed before each
+# request. reports the whole request and the template rendering alone, run it
+# before and after a change to the cards to compare
+# (CARD_CACHE_MAX_BYTES=0 turns the card cache off). the cards themselves are
+# rendered by app/item_cards.py, outside the page template, so since the card
+# cache the render column is only the rest of the page
+
+
+def _seed(items):
+    db.drop_all()
+    db.create_all()
+    password = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+    db.session.execute(insert(User), [
+        {'id': 1, 'username': 'owner', 'email': 'owner@example.com', 'password': password},
+        {'id': 2, 'username': 'borrower', 'email': 'borrower@example.com', 'password': password},
+    ])
+    db.session.execute(insert(Inventory), [{'id': 1, 'owner_id': 1, 'title': 'Big Society'}])
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    rows = [_item_row(rng, 1, now) for _ in range(items)]
+    for start in range(0, len(rows), 1000):
+        db.session.execute(insert(Item), rows[start:start + 1000])
+    # the borrower has asked for every tenth item
+    db.session.execute(insert(Loan), [{'item_id': item_id, 'borrower_id': 2, 'owner_id': 1, 'status': 'pending'}
+                                      for item_id in range(1, items + 1, 10)])
+    db.session.commit()
+    stats.reconcile()
+
+
+# renames one item before each request, so only its card has to be rendered again
+def _change_one_item(n):
+    with app.app_context():
+        db.session.execute(db.update(Item).where(Item.id == n % 100 + 1)
+                           .values(name='Renamed %d' % n, version=Item.version + 1))
+        db.session.commit()
+        cache.invalidate(cache.inventory_namespace(1))
+
+
+class RenderTimer:
+    def __init__(self):
+        self.seconds = 0.0
+        self._start = None
+        before_render_template.connect(self._before, app)
+        template_rendered.connect(self._after, app)
+
+    def _before(self, sender, **extra):
+        self._start = time.perf_counter()
+
+    def _after(self, sender, **extra):
+        self.seconds += time.perf_counter() - self._start
+
+
+def run(items, iterations):
+    with app.app_context():
+        _seed(items)
+    app.config['WTF_CSRF_ENABLED'] = True
+    # the whole inventory on one page
+    app.config['MAX_PAGE_SIZE'] = items
+    timer = RenderTimer()
+
+    results = {}
+    for name, who, url, setup in (
+        ('my_inventory', 'owner', '/my-inventory', None),
+        ('view_inventory', 'borrower', '/view-inventory/1', None),
+        ('my_inventory_one_changed', 'owner', '/my-inventory', _change_one_item),
+    ):
+        # logging in needs the csrf check off, the pages are then rendered with it on
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = _client(who)
+        app.config['WTF_CSRF_ENABLED'] = True
+        url += '?per_page=%d' % items
+        status = client.get(url).status_code
+        totals, renders = [], []
+        for n in range(iterations):
+            if setup:
+                setup(n)
+            timer.seconds = 0.0
+            start = time.perf_counter()
+            client.get(url)
+            totals.append((time.perf_counter() - start) * 1000)
+            renders.append(timer.seconds * 1000)
+        totals.sort()
+        renders.sort()
+        results[name] = {
+            'status': status,
+            'p50_ms': round(percentile(totals, 50), 3),
+            'p95_ms': round(percentile(totals, 95), 3),
+            'render_p50_ms': round(percentile(renders, 50), 3),
+            'render_p95_ms': round(percentile(renders, 95), 3),
+        }
+        print('  %-26s p50 %8.2fms  p95 %8.2fms  render p50 %8.2fms  [%d]' % (
+            name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['render_p50_ms'], status), file=sys.stderr)
+    return {'items': items, 'routes': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.card_render',
+                                     description='Time the item card pages for one big inventory.')
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    args = parser.parse_args(argv)
+
+    output = json.dumps(run(args.items, args.iterations), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
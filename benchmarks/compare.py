@@ -0,0 +1,49 @@
+import argparse
+import json
+
+# python -m benchmarks.compare before.json after.json
+# prints the change in p50/p95 latency, sql statements and peak memory for every
+# route found in both files
+
+
+def _change(old, new):
+    if not old:
+        return '     n/a'
+    return '%+7.1f%%' % ((new - old) * 100.0 / old)
+
+
+def compare(before, after):
+    lines = []
+    for scale, new_scale in after['scales'].items():
+        old_scale = before['scales'].get(scale)
+        if not old_scale:
+            continue
+        lines.append('== %s' % scale)
+        for route, new in new_scale['routes'].items():
+            old = old_scale['routes'].get(route)
+            if not old:
+                continue
+            lines.append('  %-24s p50 %s  p95 %s  sql %4d -> %-4d  peak %s' % (
+                route,
+                _change(old['p50_ms'], new['p50_ms']),
+                _change(old['p95_ms'], new['p95_ms']),
+                old['sql_statements'], new['sql_statements'],
+                _change(old['peak_memory_kb'], new['peak_memory_kb']),
+            ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(compare(before, after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import sys
+import time
+
+import benchmarks
+from app import app, compression
+from benchmarks.datagen import SCALES
+from benchmarks.routes import scenarios, _client
+
+# python -m benchmarks.compression [--scale medium] [--iterations 20] [--output results.json]
+#
+# fetches every page (and the exports) with each content encoding the app can
+# send and reports the bytes on the wire and the cpu time per request, so the
+# cost of compressing can be weighed against the bytes it saves
+
+EXPORTS = [
+    ('export_items_csv', 'owner', '/export-items.csv'),
+    ('export_items_xlsx', 'owner', '/export-items.xlsx'),
+    ('export_loans_csv', 'owner', '/export-loans.csv'),
+]
+
+
+def encodings():
+    return ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+
+
+def routes():
+    # the GET routes that don't need a fresh row each time, plus the exports
+    pages = [(name, who, url) for name, who, method, url, data, setup in scenarios()
+             if method == 'GET' and setup is None and name != 'logout']
+    return pages + EXPORTS
+
+
+def measure(client, url, encoding, iterations):
+    headers = {'Accept-Encoding': encoding}
+    response = client.get(url, headers=headers)
+    size = len(response.data)
+    cpu = []
+    for _ in range(iterations):
+        start = time.process_time()
+        # reading the data runs streamed responses (and their compression) to the end
+        client.get(url, headers=headers).data
+        cpu.append((time.process_time() - start) * 1000)
+    cpu.sort()
+    return {
+        'status': response.status_code,
+        'content_encoding': response.headers.get('Content-Encoding', 'identity'),
+        'bytes': size,
+        'cpu_p50_ms': round(cpu[len(cpu) // 2], 3),
+        'cpu_mean_ms': round(sum(cpu) / len(cpu), 3),
+    }
+
+
+def run(scale_name, iterations, progress=None):
+    from benchmarks.datagen import generate
+    from app import search
+
+    with app.app_context():
+        sizes = generate(scale_name)
+        search.rebuild_index()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    clients = {}
+    results = {}
+    for name, who, url in routes():
+        if who not in clients:
+            clients[who] = _client(who)
+        route = results[name] = {}
+        for encoding in encodings():
+            route[encoding] = measure(clients[who], url, encoding, iterations)
+        if progress:
+            progress(name, route)
+    return {'sizes': sizes, 'routes': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compression',
+                                     description='Bytes on the wire and cpu cost of each content encoding per route.')
+    parser.add_argument('--scale', default='medium', choices=sorted(SCALES))
+    parser.add_argument('--iterations', type=int, default=20, help='timed requests per route and encoding')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    args = parser.parse_args(argv)
+
+    def progress(name, route):
+        plain = route['identity']
+        line = '  %-24s identity %9d B %7.2fms' % (name, plain['bytes'], plain['cpu_p50_ms'])
+        for encoding in encodings()[1:]:
+            result = route[encoding]
+            saved = 100.0 * (plain['bytes'] - result['bytes']) / plain['bytes'] if plain['bytes'] else 0
+            line += '  %s %9d B (-%4.1f%%) %+7.2fms' % (
+                encoding, result['bytes'], saved, result['cpu_p50_ms'] - plain['cpu_p50_ms'])
+        print(line, file=sys.stderr)
+
+    print('== %s' % args.scale, file=sys.stderr)
+    results = run(args.scale, args.iterations, progress=progress)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
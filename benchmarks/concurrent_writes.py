@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import threading
+import time
+from sqlalchemy import create_engine, insert, select, update, func
+from sqlalchemy.exc import OperationalError
+
+import benchmarks
+from app import app, db
+from app.database import configure_engine
+from app.models import User, Inventory, Item, Loan
+
+# python -m benchmarks.concurrent_writes [--writers 8] [--readers 8] [--seconds 5]
+#
+# hammers a sqlite database with loan request style write transactions from
+# several threads while other threads read item lists, once with sqlites
+# default settings and once with the tuning from config.py, and reports
+# throughput and "database is locked" failures for each
+
+# what sqlalchemy and sqlite do out of the box (rollback journal, full sync,
+# the driver's default 5 second lock timeout)
+DEFAULT_SETTINGS = {
+    'SQLITE_JOURNAL_MODE': 'DELETE',
+    'SQLITE_SYNCHRONOUS': 'FULL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': -2000,
+    'SQLITE_MMAP_SIZE': 0,
+}
+
+ITEMS = 2000
+
+
+def tuned_settings():
+    return {name: app.config[name] for name in DEFAULT_SETTINGS}
+
+
+def _make_engine(path, settings):
+    engine = create_engine('sqlite:///' + path, connect_args={'timeout': settings['SQLITE_BUSY_TIMEOUT'] / 1000.0})
+    configure_engine(engine, settings)
+    return engine
+
+
+def _seed(engine):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': i, 'username': 'user%d' % i, 'email': 'user%d@example.com' % i,
+                                     'password': 'x'} for i in range(1, 51)])
+        conn.execute(insert(Inventory), [{'id': 1, 'owner_id': 1, 'title': 'Benchmark'}])
+        conn.execute(insert(Item), [{'inventory_id': 1, 'name': 'item %d' % i, 'loan_status': 'available',
+                                     'condition': 'functional'} for i in range(ITEMS)])
+
+
+def run(settings, writers, readers, seconds):
+    path = os.path.join(benchmarks.WORK_DIR, 'concurrent-%s.db' % settings['SQLITE_JOURNAL_MODE'].lower())
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    engine = _make_engine(path, settings)
+    _seed(engine)
+
+    counts = {'writes': 0, 'reads': 0, 'write_errors': 0, 'read_errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+    start_line = threading.Barrier(writers + readers)
+
+    def writer(n):
+        start_line.wait()
+        i = 0
+        while time.monotonic() < stop:
+            i += 1
+            item_id = (n * 7919 + i) % ITEMS + 1
+            try:
+                # what a loan request and approval do: add a loan and flip the item
+                with engine.begin() as conn:
+                    conn.execute(insert(Loan).values(item_id=item_id, borrower_id=n % 49 + 2, owner_id=1, status='pending'))
+                    conn.execute(update(Item).where(Item.id == item_id).values(loan_status='on_loan'))
+                key = 'writes'
+            except OperationalError:
+                key = 'write_errors'
+            with lock:
+                counts[key] += 1
+
+    def reader(n):
+        start_line.wait()
+        while time.monotonic() < stop:
+            try:
+                # what view inventory does: a page of items plus the loans on them
+                with engine.connect() as conn:
+                    ids = conn.execute(select(Item.id).where(Item.inventory_id == 1).order_by(Item.id).limit(30)).scalars().all()
+                    conn.execute(select(func.count()).select_from(Loan).where(Loan.item_id.in_(ids))).scalar()
+                key = 'reads'
+            except OperationalError:
+                key = 'read_errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    counts['writes_per_second'] = round(counts['writes'] / seconds, 1)
+    counts['reads_per_second'] = round(counts['reads'] / seconds, 1)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.concurrent_writes')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, settings in (('sqlite_defaults', DEFAULT_SETTINGS), ('tuned', tuned_settings())):
+        results[name] = run(settings, args.writers, args.readers, args.seconds)
+        results[name]['settings'] = settings
+        print('%-16s %8.1f writes/s %8.1f reads/s  %d write errors  %d read errors' % (
+            name, results[name]['writes_per_second'], results[name]['reads_per_second'],
+            results[name]['write_errors'], results[name]['read_errors']))
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
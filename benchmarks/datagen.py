@@ -0,0 +1,149 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from app import db, stats
+from app.models import User, Inventory, Item, Loan
+
+# bulk generates a realistic looking dataset for the benchmarks
+#
+# user 1 ("owner") owns the biggest inventory, user 2 ("borrower") has loans
+# on it in every state, the rest of the users own smaller inventories and
+# borrow items at random.
+# rows are written with multi-row inserts so even the largest scale only takes seconds
+
+# name: (users, inventories, items in the biggest inventory, items in the others, loans)
+SCALES = {
+    'small': (50, 10, 200, 50, 200),
+    'medium': (500, 50, 2000, 200, 2000),
+    'large': (2000, 200, 10000, 500, 20000),
+}
+
+PASSWORD = 'benchmark-password'
+
+ADJECTIVES = ['red', 'blue', 'black', 'large', 'small', 'wireless', 'vintage', 'folding', 'spare', 'stage',
+              'wooden', 'silver', 'foam', 'velvet', 'portable', 'heavy', 'battered', 'new', 'long', 'short']
+NOUNS = ['xlr cable', 'microphone', 'mic stand', 'speaker', 'drum kit', 'spotlight', 'gel pack', 'rope',
+         'cloak', 'top hat', 'sword', 'shield', 'wig', 'boots', 'table', 'chair', 'gazebo', 'tent',
+         'projector', 'extension lead', 'camera', 'tripod', 'costume rail', 'mask', 'banner', 'radio']
+SOCIETIES = ['Drama', 'Music', 'Film', 'Hiking', 'Tech Crew', 'Dance', 'Comedy', 'Opera', 'Gaming', 'Rowing']
+
+# roughly how often each condition turns up on real items
+CONDITIONS = ['functional', 'minor_repair', 'under_repair', 'out_of_service', 'missing_parts', 'inspection_needed']
+CONDITION_WEIGHTS = [70, 10, 6, 3, 6, 5]
+
+LOAN_STATES = ['pending', 'approved', 'rejected', 'returned']
+LOAN_STATE_WEIGHTS = [40, 25, 15, 20]
+
+BATCH_SIZE = 1000
+
+
+def _insert(model, rows):
+    # multi-row inserts in batches (sqlite caps the number of bound parameters)
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def _item_row(rng, inventory_id, created_at):
+    name = '%s %s' % (rng.choice(ADJECTIVES), rng.choice(NOUNS))
+    return {
+        'inventory_id': inventory_id,
+        'name': name.capitalize(),
+        'description': 'A %s from the %s store cupboard, %s.' % (
+            name, rng.choice(SOCIETIES).lower(), rng.choice(['well used', 'barely used', 'needs a clean', 'boxed'])),
+        'condition': rng.choices(CONDITIONS, CONDITION_WEIGHTS)[0],
+        'loan_status': rng.choices(['available', 'unavailable'], [85, 15])[0],
+        'created_at': created_at,
+    }
+
+
+# wipe the database and fill it with a dataset of the given scale
+# returns the number of rows written to each table
+def generate(scale, seed=0):
+    users, inventories, big_items, items_per_inventory, loans = SCALES[scale]
+    rng = random.Random(seed)
+    start = datetime(2024, 9, 1)
+
+    db.drop_all()
+    db.create_all()
+
+    # hashing is slow on purpose so every user shares the same password hash
+    password = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+    user_rows = [
+        {'id': 1, 'username': 'owner', 'email': 'owner@example.com', 'password': password, 'created_at': start},
+        {'id': 2, 'username': 'borrower', 'email': 'borrower@example.com', 'password': password, 'created_at': start},
+    ]
+    for user_id in range(3, users + 1):
+        user_rows.append({'id': user_id, 'username': 'member%d' % user_id, 'email': 'member%d@example.com' % user_id,
+                          'password': password, 'created_at': start})
+    _insert(User, user_rows)
+
+    # user 2 (the borrower) doesn't own an inventory
+    owners = [1] + list(range(3, users + 1))
+    inventory_rows = []
+    for inventory_id in range(1, inventories + 1):
+        inventory_rows.append({
+            'id': inventory_id,
+            'owner_id': owners[(inventory_id - 1) % len(owners)],
+            'title': '%s Society %d' % (rng.choice(SOCIETIES), inventory_id),
+            'description': 'Equipment and props belonging to society %d.' % inventory_id,
+            'created_at': start + timedelta(days=inventory_id),
+        })
+    _insert(Inventory, inventory_rows)
+
+    item_rows = []
+    item_owner = {}
+    for inventory in inventory_rows:
+        count = big_items if inventory['id'] == 1 else items_per_inventory
+        for _ in range(count):
+            item_rows.append(_item_row(rng, inventory['id'], start + timedelta(minutes=len(item_rows))))
+            item_owner[len(item_rows)] = inventory['owner_id']
+    for item_id, row in enumerate(item_rows, start=1):
+        row['id'] = item_id
+    _insert(Item, item_rows)
+
+    # loans: half of them are by the borrower on the owners inventory so both
+    # of their loan pages have plenty on them, the rest are spread over everyone
+    big_inventory_items = [row['id'] for row in item_rows if row['inventory_id'] == 1]
+    loan_rows = []
+    on_loan = set()
+    for n in range(loans):
+        if n % 2 == 0:
+            item_id = rng.choice(big_inventory_items)
+            borrower_id = 2
+        else:
+            item_id = rng.randint(1, len(item_rows))
+            borrower_id = rng.randint(2, users)
+            if borrower_id == item_owner[item_id]:
+                borrower_id = 2
+        status = rng.choices(LOAN_STATES, LOAN_STATE_WEIGHTS)[0]
+        # an item can only be on one approved loan at a time
+        if status == 'approved':
+            if item_id in on_loan:
+                status = 'returned'
+            else:
+                on_loan.add(item_id)
+        request_date = start + timedelta(hours=n)
+        approved_date = request_date + timedelta(hours=rng.randint(1, 72)) if status in ('approved', 'returned') else None
+        loan_rows.append({
+            'item_id': item_id,
+            'borrower_id': borrower_id,
+            'owner_id': item_owner[item_id],
+            'status': status,
+            'request_date': request_date,
+            'approved_date': approved_date,
+            'returned_date': approved_date + timedelta(days=rng.randint(1, 30)) if status == 'returned' else None,
+        })
+    _insert(Loan, loan_rows)
+
+    # items on an approved loan are on loan
+    on_loan = sorted(on_loan)
+    for start_at in range(0, len(on_loan), BATCH_SIZE):
+        db.session.execute(
+            db.update(Item).where(Item.id.in_(on_loan[start_at:start_at + BATCH_SIZE])).values(loan_status='on_loan'),
+        )
+    db.session.commit()
+    # the bulk inserts skip the counter bookkeeping, fill them in in one go
+    stats.reconcile()
+
+    return {'users': len(user_rows), 'inventories': len(inventory_rows), 'items': len(item_rows), 'loans': len(loan_rows)}
@@ -0,0 +1,192 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from sqlalchemy import insert, func
+
+import benchmarks
+from app import app, db, stats
+from app.models import User, Inventory, Item, Loan
+from werkzeug.security import generate_password_hash
+
+# python -m benchmarks.loan_stress [--borrowers 8] [--owners 4] [--items 10] [--seconds 10]
+#
+# hammers the loan routes from many threads at once: borrowers request, cancel
+# and return loans on a handful of items while several owner sessions approve and
+# reject the requests (one at a time, in bulk and through the api) as fast as they
+# can. a checker thread keeps looking at the committed data and the run fails
+# (exit status 1) if an item is ever lent to two people at once, if an approved
+# loan's item isn't marked on loan, if the inventory counters drift from the
+# real counts, or if any request errors
+
+PASSWORD = 'stress-password'
+
+
+def _seed(borrowers, items):
+    db.drop_all()
+    db.create_all()
+    password = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+    db.session.execute(insert(User), [
+        {'id': i, 'username': 'user%d' % i, 'email': 'user%d@example.com' % i, 'password': password}
+        for i in range(1, borrowers + 2)
+    ])
+    db.session.execute(insert(Inventory), [{'id': 1, 'owner_id': 1, 'title': 'Stress'}])
+    db.session.execute(insert(Item), [
+        {'inventory_id': 1, 'name': 'item %d' % i, 'loan_status': 'available', 'condition': 'functional'}
+        for i in range(items)
+    ])
+    db.session.commit()
+    stats.reconcile()
+
+    from app import auth
+    return auth.create_api_token(1, 'stress')
+
+
+def _client(user_id):
+    client = app.test_client()
+    client.post('/login', data={'email': 'user%d@example.com' % user_id, 'password': PASSWORD})
+    return client
+
+
+def _loan_ids(**filters):
+    with app.app_context():
+        return db.session.scalars(db.select(Loan.id).filter_by(**filters)).all()
+
+
+# the invariants, checked against committed data
+def find_violations():
+    with app.app_context():
+        lent_twice = db.session.execute(
+            db.select(Loan.item_id, func.count())
+            .where(Loan.status == 'approved')
+            .group_by(Loan.item_id)
+            .having(func.count() > 1)
+        ).all()
+        not_on_loan = db.session.execute(
+            db.select(Loan.id, Item.id, Item.loan_status)
+            .join(Loan.item)
+            .where(Loan.status == 'approved', Item.loan_status != 'on_loan')
+        ).all()
+    return (['item %d has %d approved loans' % tuple(row) for row in lent_twice] +
+            ['loan %d is approved but item %d is %s' % tuple(row) for row in not_on_loan])
+
+
+def run(borrowers, owners, items, seconds, seed=0):
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        token = _seed(borrowers, items)
+
+    # the clock only starts once every thread has logged in and reached the start line
+    deadline = []
+    start_line = threading.Barrier(borrowers + owners + 1, action=lambda: deadline.append(time.monotonic() + seconds))
+
+    def running():
+        return time.monotonic() < deadline[0]
+
+    statuses = Counter()
+    actions = Counter()
+    violations = []
+    lock = threading.Lock()
+
+    def record(action, response):
+        with lock:
+            actions[action] += 1
+            statuses[response.status_code] += 1
+
+    def borrower(user_id):
+        rng = random.Random(seed * 1000 + user_id)
+        client = _client(user_id)
+        start_line.wait()
+        while running():
+            roll = rng.random()
+            if roll < 0.6:
+                record('request', client.post('/loan-request/%d' % rng.randint(1, items)))
+            elif roll < 0.8:
+                mine = _loan_ids(borrower_id=user_id, status='approved')
+                if mine:
+                    record('return', client.post('/return-loan-request/%d' % rng.choice(mine)))
+            else:
+                mine = _loan_ids(borrower_id=user_id, status='pending')
+                if mine:
+                    record('cancel', client.post('/cancel-loan-request/%d' % rng.choice(mine)))
+
+    def owner(n):
+        rng = random.Random(seed * 1000 + 500 + n)
+        client = _client(1)
+        start_line.wait()
+        while running():
+            pending = _loan_ids(owner_id=1, status='pending')
+            if not pending:
+                continue
+            chosen = rng.sample(pending, min(len(pending), rng.randint(1, 5)))
+            roll = rng.random()
+            if roll < 0.4:
+                record('approve', client.post('/approve-loan-request/%d' % chosen[0]))
+            elif roll < 0.7:
+                record('bulk_approve', client.post('/bulk-loan-requests',
+                                                   data={'approve': 'Approve Selected', 'loan_ids': chosen}))
+            elif roll < 0.9:
+                record('api_batch', client.post('/api/v1/loans/batch', headers={'Authorization': 'Bearer ' + token},
+                                                json={'approve': chosen[:-1], 'reject': chosen[-1:]}))
+            else:
+                record('reject', client.post('/reject-loan-request/%d' % chosen[0]))
+
+    def checker():
+        start_line.wait()
+        while running():
+            found = find_violations()
+            if found:
+                with lock:
+                    violations.extend(found)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=borrower, args=(user_id,)) for user_id in range(2, borrowers + 2)]
+    threads += [threading.Thread(target=owner, args=(n,)) for n in range(owners)]
+    threads.append(threading.Thread(target=checker))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    violations.extend(find_violations())
+    with app.app_context():
+        counters, actual = stats.get(1), stats.compute([1])[1]
+        if counters != actual:
+            violations.append('counters %r != actual %r' % (counters, actual))
+        loan_counts = dict(db.session.execute(db.select(Loan.status, func.count()).group_by(Loan.status)).all())
+    return {
+        'actions': dict(actions),
+        'status_codes': {str(code): count for code, count in statuses.items()},
+        'loans_left': loan_counts,
+        'violations': sorted(set(violations)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loan_stress')
+    parser.add_argument('--borrowers', type=int, default=8)
+    parser.add_argument('--owners', type=int, default=4)
+    parser.add_argument('--items', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = run(args.borrowers, args.owners, args.items, args.seconds, args.seed)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+    errors = sum(count for code, count in result['status_codes'].items() if code.startswith('5'))
+    if result['violations'] or errors:
+        print('FAILED: %d violations, %d server errors' % (len(result['violations']), errors), file=sys.stderr)
+        sys.exit(1)
+    # a run that never got to do anything proves nothing
+    if not result['actions']:
+        print('FAILED: no loan actions were completed', file=sys.stderr)
+        sys.exit(1)
+    print('ok: no item was ever lent twice', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
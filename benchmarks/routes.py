@@ -0,0 +1,174 @@
+import time
+import tracemalloc
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app, db, search
+from app.models import Item, Loan
+from benchmarks.datagen import PASSWORD
+
+# drives every route in app/views.py through the flask test client and records
+# latency percentiles, sql statements and peak memory for each one
+
+
+class StatementCounter:
+    # counts every statement sent to the database
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+statements = StatementCounter()
+
+
+def percentile(samples, percent):
+    # nearest rank percentile of an already sorted list
+    index = max(0, min(len(samples) - 1, int(round(percent / 100.0 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+# helpers that make a fresh row for routes that use one up (deleting, approving...)
+def _new_item(owner_inventory_id=1, loan_status='available'):
+    with app.app_context():
+        item = Item(inventory_id=owner_inventory_id, name='Benchmark item', description='made for a benchmark',
+                    loan_status=loan_status, condition='functional')
+        db.session.add(item)
+        db.session.commit()
+        return item.id
+
+
+def _new_loan(status='pending'):
+    item_id = _new_item(loan_status='on_loan' if status == 'approved' else 'available')
+    with app.app_context():
+        loan = Loan(item_id=item_id, borrower_id=2, owner_id=1, status=status)
+        db.session.add(loan)
+        db.session.commit()
+        return loan.id
+
+
+ITEM_FORM = {'name': 'Benchmark item', 'description': 'edited by a benchmark',
+             'loan_status': 'available', 'condition': 'functional'}
+
+
+# (name, who is logged in, method, url (or a function of the setup value), form data, setup)
+# "owner" owns inventory 1, "borrower" has loans on it, None is logged out
+def scenarios():
+    return [
+        ('home', None, 'GET', '/', None, None),
+        ('login_form', None, 'GET', '/login', None, None),
+        ('login', None, 'POST', '/login', {'email': 'owner@example.com', 'password': PASSWORD}, None),
+        ('signup_form', None, 'GET', '/signup', None, None),
+        ('signup', None, 'POST', lambda n: '/signup',
+            lambda n: {'username': 'bench%d' % n, 'email': 'bench%d@example.com' % n,
+                       'password': PASSWORD, 'confirm': PASSWORD}, None),
+        ('logout', 'owner', 'GET', '/logout', None, None),
+        ('all_inventories', None, 'GET', '/all-inventories', None, None),
+        ('view_inventory', None, 'GET', '/view-inventory/1', None, None),
+        ('view_inventory_member', 'borrower', 'GET', '/view-inventory/1', None, None),
+        ('search_items', None, 'GET', '/search?q=xlr+cable', None, None),
+        ('my_inventory', 'owner', 'GET', '/my-inventory', None, None),
+        ('inventory_dashboard', 'owner', 'GET', '/inventory-dashboard', None, None),
+        ('create_inventory_form', 'borrower', 'GET', '/create-inventory', None, None),
+        ('manage_inventory_form', 'owner', 'GET', '/manage-inventory', None, None),
+        ('manage_inventory', 'owner', 'POST', '/manage-inventory',
+            {'title': 'Benchmark Society', 'description': 'renamed by a benchmark'}, None),
+        ('create_item_form', 'owner', 'GET', '/create-item', None, None),
+        ('create_item', 'owner', 'POST', '/create-item', ITEM_FORM, None),
+        ('edit_item_form', 'owner', 'GET', lambda item_id: '/edit/%d' % item_id, None, _new_item),
+        ('edit_item', 'owner', 'POST', lambda item_id: '/edit/%d' % item_id, ITEM_FORM, _new_item),
+        ('delete_item', 'owner', 'POST', lambda item_id: '/delete/%d' % item_id, None, _new_item),
+        ('loan_request', 'borrower', 'POST', lambda item_id: '/loan-request/%d' % item_id, None, _new_item),
+        ('manage_loans', 'owner', 'GET', '/manage-loans', None, None),
+        ('view_loan_requests', 'borrower', 'GET', '/view-loans', None, None),
+        ('view_notifications', 'borrower', 'GET', '/notifications', None, None),
+        ('approve_loan', 'owner', 'POST', lambda loan_id: '/approve-loan-request/%d' % loan_id, None, _new_loan),
+        ('reject_loan', 'owner', 'POST', lambda loan_id: '/reject-loan-request/%d' % loan_id, None, _new_loan),
+        ('cancel_loan_request', 'borrower', 'POST', lambda loan_id: '/cancel-loan-request/%d' % loan_id, None, _new_loan),
+        ('clear_loan_request', 'borrower', 'POST', lambda loan_id: '/clear-loan-request/%d' % loan_id, None,
+            lambda: _new_loan('rejected')),
+        ('return_loan_request', 'borrower', 'POST', lambda loan_id: '/return-loan-request/%d' % loan_id, None,
+            lambda: _new_loan('approved')),
+    ]
+
+
+def _client(who):
+    client = app.test_client()
+    if who:
+        client.post('/login', data={'email': '%s@example.com' % who, 'password': PASSWORD})
+    return client
+
+
+def _request(client, method, url, data, setup_value, n):
+    if callable(url):
+        url = url(setup_value if setup_value is not None else n)
+    if callable(data):
+        data = data(n)
+    return client.open(url, method=method, data=data)
+
+
+# run one scenario: a warm up request, one request under tracemalloc for the
+# memory peak, then the timed iterations (tracemalloc would skew the timings)
+def run_scenario(scenario, iterations):
+    name, who, method, url, data, setup = scenario
+    clients = {}
+
+    def prepare(n):
+        # logout signs the client out so it needs a new one every time
+        if who not in clients or name == 'logout':
+            clients[who] = _client(who)
+        return clients[who], setup() if setup else None
+
+    client, value = prepare(0)
+    response = _request(client, method, url, data, value, 0)
+    status = response.status_code
+
+    client, value = prepare(1)
+    tracemalloc.start()
+    _request(client, method, url, data, value, 1)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = []
+    sql_counts = []
+    for n in range(2, iterations + 2):
+        client, value = prepare(n)
+        before = statements.count
+        start = time.perf_counter()
+        _request(client, method, url, data, value, n)
+        timings.append((time.perf_counter() - start) * 1000)
+        sql_counts.append(statements.count - before)
+
+    timings.sort()
+    return {
+        'method': method,
+        'status': status,
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'sql_statements': max(sql_counts),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def run(scale_name, iterations, only=None, progress=None):
+    from benchmarks.datagen import generate
+
+    with app.app_context():
+        sizes = generate(scale_name)
+        search.rebuild_index()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = {}
+    for scenario in scenarios():
+        if only and scenario[0] not in only:
+            continue
+        # requests are made outside of an app context so each one gets its own
+        # database session, like it would in production
+        results[scenario[0]] = run_scenario(scenario, iterations)
+        if progress:
+            progress(scenario[0], results[scenario[0]])
+    return {'sizes': sizes, 'routes': results}
@@ -0,0 +1,90 @@
+# prints the query plan for every query the views run so we can check they
+# all use an index instead of scanning a whole table
+#
+# usage: python explain_queries.py
+# on sqlite any line starting with SCAN (without "USING ... INDEX") is a full table
+# scan, on postgresql it's a "Seq Scan" (postgres will still pick one on tiny
+# tables, run it against a database with realistic data)
+
+from sqlalchemy.orm import joinedload
+from app import app, db, conditional
+from app.models import User, Inventory, Item, Loan
+
+# example ids, the plan doesn't depend on the values
+USER_ID = 1
+INVENTORY_ID = 1
+ITEM_ID = 1
+PAGE_SIZE = app.config['PAGE_SIZE']
+
+
+def view_queries():
+    # (view, description, query) for each query the views issue
+    return [
+        ("login", "user by email",
+            User.query.filter_by(email="someone@example.com")),
+        ("my_inventory", "inventory by owner",
+            Inventory.query.filter_by(owner_id=USER_ID)),
+        ("my_inventory / view_inventory", "page of items in an inventory",
+            Item.query.filter_by(inventory_id=INVENTORY_ID).filter(Item.id > 0).order_by(Item.id).limit(PAGE_SIZE + 1)),
+        ("all_inventories", "page of inventories",
+            Inventory.query.filter(Inventory.id > 0).order_by(Inventory.id).limit(PAGE_SIZE + 1)),
+        ("view_inventory", "items on the page the user has a loan on",
+            db.session.query(Loan.item_id).filter(Loan.borrower_id == USER_ID, Loan.item_id.in_([1, 2, 3]),
+                                                 Loan.status.in_(["pending", "approved"]))),
+        ("manage_loans", "loans on an owners items with item and borrower",
+            Loan.query.filter_by(owner_id=USER_ID).options(joinedload(Loan.item), joinedload(Loan.borrower))),
+        ("view_loan_requests", "a borrowers loans with item and inventory",
+            Loan.query.filter_by(borrower_id=USER_ID).options(joinedload(Loan.item).joinedload(Item.inventory))),
+        ("delete_item", "loans removed along with an item",
+            Loan.query.filter_by(item_id=ITEM_ID)),
+        # the single aggregate query behind the conditional GETs (app/conditional.py)
+        ("all_inventories", "etag: newest change to the inventories",
+            db.session.query(*conditional.inventories())),
+        ("view_inventory", "etag: newest change to an inventory, its items and the users loans of them",
+            db.session.query(*conditional.inventory(INVENTORY_ID), *conditional.borrowed_from(INVENTORY_ID, USER_ID))),
+        ("my_inventory", "etag: newest change to an owners inventory, items and loans",
+            db.session.query(*conditional.owned_inventory(USER_ID), *conditional.owned_loans(USER_ID))),
+    ]
+
+
+def explain(query):
+    # compile the query the way the ORM would send it (with the example values inlined)
+    # and ask the database for the plan
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+    if db.engine.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+    return [row[-1] for row in db.session.connection().exec_driver_sql(prefix + str(compiled))]
+
+
+def is_full_scan(detail):
+    if db.engine.dialect.name == "sqlite":
+        # "SCAN CONSTANT ROW" is a SELECT with no FROM (just subqueries), not a table
+        return detail.startswith("SCAN") and "INDEX" not in detail and detail != "SCAN CONSTANT ROW"
+    return "Seq Scan" in detail
+
+
+def main():
+    with app.app_context():
+        if db.engine.dialect.name not in ("sqlite", "postgresql"):
+            print("don't know how to explain queries on %s" % db.engine.dialect.name)
+            return 1
+
+        full_scans = 0
+        for view, description, query in view_queries():
+            print("%s: %s" % (view, description))
+            for detail in explain(query):
+                flag = ""
+                if is_full_scan(detail):
+                    flag = "   <-- full table scan"
+                    full_scans += 1
+                print("    " + detail + flag)
+            print()
+
+        print("%d full table scan(s) found" % full_scans)
+        return 1 if full_scans else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
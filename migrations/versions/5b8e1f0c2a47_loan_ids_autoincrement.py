@@ -0,0 +1,32 @@
+"""loan ids autoincrement
+
+Revision ID: 5b8e1f0c2a47
+Revises: def37bc87c91
+Create Date: 2026-10-18 21:05:12.318540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e1f0c2a47'
+down_revision = 'def37bc87c91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sqlite only, the table is rebuilt with AUTOINCREMENT so the id of a deleted
+    # loan is never given to a new one (other databases never reuse ids anyway)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('loans', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('loans', schema=None, recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
@@ -0,0 +1,39 @@
+# the tests run against a throwaway sqlite database, so the environment is
+# pointed at it here, before anything imports the app (and with it config.py)
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+WORK_DIR = tempfile.mkdtemp(prefix='inventory-tests-')
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'test.db')
+os.environ['SEARCH_INDEX_DIR'] = os.path.join(WORK_DIR, 'search-index')
+os.environ['PHOTO_DIR'] = os.path.join(WORK_DIR, 'photos')
+os.environ['CACHE_DIR'] = os.path.join(WORK_DIR, 'cache')
+os.environ['JOBS_WORKERS'] = '0'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app, db
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+    yield app
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+# a test client logged in as the given user id
+@pytest.fixture
+def login(app):
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return login
@@ -0,0 +1,108 @@
+import random
+import threading
+from sqlalchemy import func, insert
+from app import db, stats
+from app.models import User, Inventory, Item, Loan
+
+# approving loans is a compare-and-set (app/loans.py), so owners approving the
+# same requests from several threads at once must never lend an item twice, and
+# the inventory counters must still match the items and loans afterwards
+
+BORROWERS = 6
+ITEMS = 3
+OWNER_THREADS = 4
+
+
+def make_inventory():
+    owner = User(username='lender', email='lender@example.com', password='x')
+    borrowers = [User(username='borrower%d' % n, email='borrower%d@example.com' % n, password='x') for n in range(BORROWERS)]
+    db.session.add_all([owner] + borrowers)
+    db.session.flush()
+    inventory = Inventory(owner_id=owner.id, title='Shared')
+    db.session.add(inventory)
+    db.session.flush()
+    item_ids = db.session.execute(insert(Item).returning(Item.id), [
+        {'inventory_id': inventory.id, 'name': 'item %d' % n, 'condition': 'functional', 'loan_status': 'available'}
+        for n in range(ITEMS)
+    ]).scalars().all()
+    db.session.commit()
+    # the bulk insert skips the orm events that keep the counters
+    stats.reconcile([inventory.id])
+    return owner.id, [borrower.id for borrower in borrowers], inventory.id, item_ids
+
+
+def pending_loan_ids(owner_id):
+    return db.session.scalars(db.select(Loan.id).where(Loan.owner_id == owner_id, Loan.status == 'pending')).all()
+
+
+# run fn(n) in a thread for each n at once, returning the status codes
+def run_together(count, fn):
+    start_line = threading.Barrier(count)
+    statuses = []
+
+    def run(n):
+        start_line.wait()
+        statuses.extend(fn(n))
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def violations(inventory_id):
+    lent_twice = db.session.execute(
+        db.select(Loan.item_id).where(Loan.status == 'approved').group_by(Loan.item_id).having(func.count() > 1)
+    ).scalars().all()
+    not_on_loan = db.session.execute(
+        db.select(Loan.id).join(Loan.item).where(Loan.status == 'approved', Item.loan_status != 'on_loan')
+    ).scalars().all()
+    found = ['item %d lent twice' % item_id for item_id in lent_twice]
+    found += ['loan %d approved but its item is not on loan' % loan_id for loan_id in not_on_loan]
+    if stats.get(inventory_id) != stats.compute([inventory_id])[inventory_id]:
+        found.append('counters drifted')
+    return found
+
+
+def test_concurrent_approvals_never_lend_an_item_twice(app, login):
+    with app.app_context():
+        owner_id, borrower_ids, inventory_id, item_ids = make_inventory()
+
+    borrowers = [login(user_id) for user_id in borrower_ids]
+    owners = [login(owner_id) for _ in range(OWNER_THREADS)]
+
+    for round in range(3):
+        # every borrower asks for every item (the ones still on loan are refused)
+        statuses = run_together(BORROWERS, lambda n: [
+            borrowers[n].post('/loan-request/%d' % item_id).status_code for item_id in item_ids
+        ])
+        with app.app_context():
+            pending = pending_loan_ids(owner_id)
+        assert pending
+
+        # each owner session approves the same requests, in a different order
+        def approve(n):
+            rng = random.Random(round * 100 + n)
+            chosen = rng.sample(pending, len(pending))
+            return [
+                owners[n].post('/bulk-loan-requests', data={'approve': 'Approve Selected', 'loan_ids': chosen}).status_code,
+                owners[n].post('/approve-loan-request/%d' % chosen[0]).status_code,
+            ]
+        statuses += run_together(OWNER_THREADS, approve)
+
+        with app.app_context():
+            assert violations(inventory_id) == []
+            assert db.session.scalar(db.select(func.count()).where(Loan.owner_id == owner_id, Loan.status == 'approved')) == ITEMS
+            approved = db.session.execute(db.select(Loan.id, Loan.borrower_id).where(Loan.owner_id == owner_id, Loan.status == 'approved')).all()
+
+        # the borrowers give everything back at once, ready for the next round
+        statuses += run_together(len(approved), lambda n: [
+            borrowers[borrower_ids.index(approved[n].borrower_id)].post('/return-loan-request/%d' % approved[n].id).status_code
+        ])
+        with app.app_context():
+            assert violations(inventory_id) == []
+            assert db.session.scalar(db.select(func.count()).where(Loan.owner_id == owner_id, Loan.status == 'approved')) == 0
+
+        assert all(status < 500 for status in statuses)
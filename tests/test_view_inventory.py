@@ -0,0 +1,62 @@
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from app import db
+from app.models import User, Inventory, Item, Loan
+
+# view inventory works out the loan state of every item on the page with one
+# query, so the number of statements it runs mustn't grow with the items
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def make_inventory(owner_id, borrower_id, items):
+    inventory = Inventory(owner_id=owner_id, title='%d items' % items)
+    db.session.add(inventory)
+    db.session.flush()
+    item_ids = db.session.execute(insert(Item).returning(Item.id), [
+        {'inventory_id': inventory.id, 'name': 'item %d' % n, 'condition': 'functional', 'loan_status': 'available'}
+        for n in range(items)
+    ]).scalars().all()
+    # the borrower has asked for every other item
+    db.session.execute(insert(Loan), [
+        {'item_id': item_id, 'borrower_id': borrower_id, 'owner_id': owner_id, 'status': 'pending'}
+        for item_id in item_ids[::2]
+    ])
+    db.session.commit()
+    return inventory.id
+
+
+def count_statements(client, url):
+    counter = StatementCounter()
+    event.listen(Engine, 'before_cursor_execute', counter)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', counter)
+    assert response.status_code == 200
+    return counter.count
+
+
+def test_view_inventory_runs_the_same_statements_for_any_number_of_items(app, login):
+    with app.app_context():
+        owner = User(username='owner', email='owner@example.com', password='x')
+        borrower = User(username='borrower', email='borrower@example.com', password='x')
+        db.session.add_all([owner, borrower])
+        db.session.commit()
+        borrower_id = borrower.id
+        small = make_inventory(owner.id, borrower_id, 5)
+        large = make_inventory(owner.id, borrower_id, 50)
+
+    client = login(borrower_id)
+    # the first request also puts the user in the user cache (app/auth.py)
+    client.get('/')
+    # every item on one page
+    small_count = count_statements(client, '/view-inventory/%d?per_page=100' % small)
+    large_count = count_statements(client, '/view-inventory/%d?per_page=100' % large)
+    assert small_count == large_count